@@ -0,0 +1,73 @@
+# ------------------------------------------------------------------
+#  Pick accuracy of the coarse (cam_pos size) vs the refined (refine size crop) target
+#  python -m bench.coarse_to_fine [--batteries 12] [--scenes 5] [--model]
+# ------------------------------------------------------------------
+# Every scene is a SyntheticCapture (engine.synthetic) that also renders the refine size
+# with refine_calib. BatteryLocator detects at the cam_pos size, then every detection is
+# sent through PickRefiner.refine() as if it were the pick target, and both are checked
+# against the ground truth: centre / angle error and the time one refine takes. That time
+# has a full tag solve on the big frame (h_cache off here, the station keeps it) and no
+# camera mode switch (~0.5 s on USB cameras). The masks come from ColorBackend unless --model.
+import argparse
+import time
+
+import numpy as np
+
+import engine.loader as ldr
+from engine.geometry import DET_DTYPE
+from engine.pick import as_coords
+from engine.refine import PickRefiner
+from engine.synthetic import ColorBackend, SyntheticCapture, pose_error
+
+
+def run_scene(n, seed, use_model, cfg):
+    from engine.detection import BatteryLocator
+
+    cap = SyntheticCapture(n, (cfg["width"] or 640, cfg["height"] or 480), cfg, seed=seed,
+                           modes={(cfg["refine_width"], cfg["refine_height"]): cfg["refine_calib"]})
+    model = None if use_model else ColorBackend(rects=cfg["mask_moments"])
+    bl = BatteryLocator({**cfg, "grab_thread": 0, "motion_gate": 0}, cap=cap, model=model)
+    refiner = PickRefiner(bl, cfg)
+    coarse, fine, ms = [], [], []
+    try:
+        for _ in range(5):  # H solve
+            bl.update()
+        poses = cap.poses
+        for row in bl.last_detections:
+            target = as_coords(row)
+            t = time.perf_counter()
+            refined = refiner.refine(target)
+            ms.append((time.perf_counter() - t) * 1e3)
+            for out, arr in ((coarse, target), (fine, refined)):
+                det = np.array([(*arr, 1.0)], DET_DTYPE)
+                ce, ae = pose_error(det, poses)
+                if len(ce):
+                    out.append((ce[0], ae[0]))
+    finally:
+        bl.release()
+    return np.array(coarse).reshape(-1, 2), np.array(fine).reshape(-1, 2), ms, refiner.refined
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coarse vs refined pick accuracy on synthetic frames")
+    parser.add_argument("--batteries", type=int, default=12)
+    parser.add_argument("--scenes", type=int, default=5, help="battery layouts")
+    parser.add_argument("--model", action="store_true", help="run the configured model instead of ColorBackend")
+    args = parser.parse_args()
+
+    cfg = {**ldr.usr_cfg["cam_pos"], "h_cache": 0}  # don't overwrite the station's homographies
+    coarse, fine, ms, refined = [], [], [], 0
+    for seed in range(args.scenes):
+        c, f, t, r = run_scene(args.batteries, seed, args.model, cfg)
+        coarse.append(c)
+        fine.append(f)
+        ms += t
+        refined += r
+    coarse, fine = np.concatenate(coarse), np.concatenate(fine)
+    print(f"{cfg['camera_calib']} -> {cfg['refine_calib']} {cfg['refine_width']}x{cfg['refine_height']}, "
+          f"crop {cfg['refine_crop_mm']:g} mm, {'model' if args.model else 'ColorBackend'}")
+    print(f"targets {len(ms)}, refined {refined}, refine {np.median(ms):.1f} ms (p50) / {np.max(ms):.1f} ms (max)\n")
+    print(f"{'':<8}{'centre mm (mean/max)':>22}{'angle deg (mean/max)':>22}")
+    for name, e in (("coarse", coarse), ("refined", fine)):
+        print(f"{name:<8}{'%.2f / %.2f' % (e[:, 0].mean(), e[:, 0].max()):>22}"
+              f"{'%.2f / %.2f' % (e[:, 1].mean(), e[:, 1].max()):>22}")
@@ -0,0 +1,64 @@
+# ------------------------------------------------------------------
+#  Inference backends on synthetic tray crops: latency and per-frame garbage
+#  python -m bench.lean_runtime [--backends torch,lean,onnx] [--frames 500] [--batteries 12]
+# ------------------------------------------------------------------
+# Every backend of engine.inference (the configured model, exported once for onnx / lean)
+# runs predict() on the same synthetic tray frame (engine.synthetic) at the configured
+# input size. Reports the latency and, to see if a 12 hour shift stays flat, what a frame
+# leaves behind: Python heap growth (tracemalloc) and gen-0 collections per 100 frames.
+import argparse
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+import engine.loader as ldr
+from engine.inference import load_backend, onnx_imgsz, warm_up
+from engine.synthetic import SyntheticCapture
+
+
+def run(backend, frames, frame, cfg):
+    model = load_backend({**cfg, "backend": backend})
+    warm_up(model, cfg)
+    size = onnx_imgsz(cfg)
+    kw = {"imgsz": size} if cfg["roi_crop"] else {}
+    lat = np.empty(frames)
+    gc.collect()
+    gen0 = gc.get_stats()[0]["collections"]
+    tracemalloc.start()
+    heap0 = tracemalloc.get_traced_memory()[0]
+    n_det = 0
+    for i in range(frames):
+        t = time.perf_counter()
+        res = model.predict(frame, cfg["conf"], **kw)
+        lat[i] = (time.perf_counter() - t) * 1e3
+        n_det = len(res.boxes)
+    heap = tracemalloc.get_traced_memory()[0] - heap0
+    tracemalloc.stop()
+    collections = gc.get_stats()[0]["collections"] - gen0
+    return lat, heap, collections, n_det
+
+
+if __name__ == "__main__":
+    cfg = ldr.usr_cfg["cam_pos"]
+    parser = argparse.ArgumentParser(description="Latency / garbage of the inference backends")
+    parser.add_argument("--backends", default="torch,lean,onnx")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--batteries", type=int, default=12)
+    args = parser.parse_args()
+
+    ok, frame = SyntheticCapture(args.batteries).read()
+    print(f"{cfg['detect_model']}, input {onnx_imgsz(cfg)}px, {args.frames} frames "
+          f"(tracemalloc on, latencies are slower than on the station)\n")
+    print(f"{'backend':<8}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}{'heap KB/100 fr':>16}{'gc0/100 fr':>12}{'det':>5}")
+    for backend in args.backends.split(","):
+        try:
+            lat, heap, collections, n_det = run(backend, args.frames, frame, cfg)
+        except ImportError as e:
+            print(f"{backend:<8}skipped: {e}")
+            continue
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        per100 = 100 / args.frames
+        print(f"{backend:<8}{p50:>8.2f}{p95:>8.2f}{p99:>8.2f}{heap / 1024 * per100:>16.1f}"
+              f"{collections * per100:>12.1f}{n_det:>5}")
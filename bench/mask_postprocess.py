@@ -0,0 +1,80 @@
+# ------------------------------------------------------------------
+#  Micro-benchmark: mask post-processing cost per detection
+#  python -m bench.mask_postprocess [--size 640x480] [--repeat 200]
+# ------------------------------------------------------------------
+# Compares the old full-frame path of BatteryLocator.update (one h x w mask per battery,
+# new kernel each time, frame.copy() + addWeighted per battery) with
+# engine.postprocess.MaskPostProcessor, for 1, 5 and 20 batteries on the tray.
+# Needs only numpy + OpenCV, no camera or model.
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from engine.postprocess import MaskPostProcessor
+
+
+def make_polys(n, w_img, h_img, seed=0):
+    # 9V battery is ~26.5 x 48.5 mm, ~1.6 px/mm at 480p
+    rng = np.random.default_rng(seed)
+    polys = []
+    for _ in range(n):
+        center = (rng.uniform(80, w_img - 80), rng.uniform(80, h_img - 80))
+        rect = (center, (42, 77), rng.uniform(0, 180))
+        polys.append(cv2.boxPoints(rect).astype(np.int32))
+    return polys
+
+
+def old_path(frame, polys, show_masks):
+    h_img, w_img = frame.shape[:2]
+    rects = []
+    for cnt in polys:
+        mask = np.zeros((h_img, w_img), np.uint8)
+        cv2.fillPoly(mask, [cnt], 255)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+        cnt2, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        rects.append(cv2.minAreaRect(cnt2[0]))
+        if show_masks:
+            overlay = frame.copy()
+            overlay[mask.astype(bool)] = (0, 0, 200)
+            cv2.addWeighted(overlay, 0.35, frame, 0.65, 0, frame)
+    return rects
+
+
+def new_path(post, frame, polys, show_masks):
+    _, rects = post.process(polys)
+    if show_masks:
+        post.blend(frame)
+    return rects
+
+
+def bench(fn, repeat):
+    fn()  # warm-up
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mask post-processing micro-benchmark")
+    parser.add_argument("--size", default="640x480", help="frame size WxH")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    w_img, h_img = map(int, args.size.lower().split("x"))
+    frame = np.full((h_img, w_img, 3), 120, np.uint8)
+
+    print(f"Frame {w_img}x{h_img}, {args.repeat} runs, per-detection cost in us")
+    print(f"{'n':>3} {'masks':>5} | {'old':>9} {'new':>9} {'close=0':>9} | speed-up")
+    for n in (1, 5, 20):
+        polys = make_polys(n, w_img, h_img)
+        for show in (0, 1):
+            post = MaskPostProcessor((w_img, h_img), close=True)
+            post_fast = MaskPostProcessor((w_img, h_img), close=False)
+            t_old = bench(lambda: old_path(frame, polys, show), args.repeat) / n
+            t_new = bench(lambda: new_path(post, frame, polys, show), args.repeat) / n
+            t_fast = bench(lambda: new_path(post_fast, frame, polys, show), args.repeat) / n
+            print(f"{n:>3} {show:>5} | {t_old * 1e6:>9.1f} {t_new * 1e6:>9.1f} {t_fast * 1e6:>9.1f} "
+                  f"| x{t_old / t_new:.1f} / x{t_old / t_fast:.1f}")
@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------
+#  Load + accuracy sweep of BatteryLocator on synthetic tray frames
+#  python -m bench.synthetic_load [--batteries 1,5,10,15] [--frames 100] [--model] [--battery 48.5x26.5]
+# ------------------------------------------------------------------
+# For every battery count a SyntheticCapture (engine.synthetic) feeds BatteryLocator.update()
+# with the camera settings of userConfig (remap / undistort_points / tray_view, roi_crop),
+# and the result is checked against the ground truth of the scene:
+#   centre / angle error of the detections (rects_to_mm, the _angle_table path), found / placed
+#   homography error: tray grid points through the true and the solved H, mm, every frame
+#   per-frame latency and FPS, to see how the cost scales with the number of batteries
+# The masks come from engine.synthetic.ColorBackend unless --model (the configured model,
+# which has to recognise the rendered sprites); with cam_pos.mask_moments it measures the
+# rects on 1/4 scale soft masks, like the model protos. A 9V tray takes ~15 batteries, use a
+# smaller --battery for the 20-50 range.
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.homography import tray_world_corners
+from engine.synthetic import BATTERY_MM, ColorBackend, SyntheticCapture, pose_error
+
+
+def homography_error(H_est, H_true, cfg):
+    """Max distance (mm) between a tray grid mapped through H_true^-1 then H_est, and itself"""
+    L, W = tray_world_corners(cfg)[2]
+    gx, gy = np.meshgrid(np.linspace(0, L, 9), np.linspace(0, W, 7))
+    mm = np.stack([gx, gy], axis=-1).reshape(1, -1, 2)
+    px = cv2.perspectiveTransform(mm, np.linalg.inv(H_true))
+    back = cv2.perspectiveTransform(px, H_est)
+    return float(np.abs(back - mm).max())
+
+
+def run(n, frames, use_model, battery_mm, size, cfg):
+    from engine.detection import BatteryLocator
+
+    cap = SyntheticCapture(n, size, cfg, battery_mm=battery_mm)
+    model = None if use_model else ColorBackend(rects=cfg["mask_moments"])
+    bl = BatteryLocator({**cfg, "grab_thread": 0, "motion_gate": 0, "h_cache": 0, "profile": 0}, cap=cap, model=model)
+    lat, ce, ae, found, h_err = [], [], [], [], []
+    try:
+        for i in range(frames + 5):
+            t = time.perf_counter()
+            frame = bl.update()
+            dt = time.perf_counter() - t
+            if frame is None or i < 5:  # warm-up, H solve
+                continue
+            lat.append(dt * 1e3)
+            c, a = pose_error(bl.last_detections, cap.poses, battery_mm)
+            ce.append(c)
+            ae.append(a)
+            found.append(len(c))
+            if bl.homography.H is not None:
+                h_err.append(homography_error(bl.homography.H, cap.H, cfg))
+    finally:
+        bl.release()
+    lat = np.array(lat)
+    ce, ae = np.concatenate(ce), np.concatenate(ae)
+    return {
+        "placed": len(cap.poses),
+        "found": np.mean(found) if found else 0.0,
+        "fps": 1e3 / lat.mean() if len(lat) else 0.0,
+        "p50": np.percentile(lat, 50) if len(lat) else 0.0,
+        "p95": np.percentile(lat, 95) if len(lat) else 0.0,
+        "centre": (ce.mean(), ce.max()) if len(ce) else (np.nan, np.nan),
+        "angle": (ae.mean(), ae.max()) if len(ae) else (np.nan, np.nan),
+        "h_err": (np.mean(h_err), np.max(h_err)) if h_err else (np.nan, np.nan),
+    }
+
+
+if __name__ == "__main__":
+    cfg = ldr.usr_cfg["cam_pos"]
+    parser = argparse.ArgumentParser(description="BatteryLocator load / accuracy on synthetic frames")
+    parser.add_argument("--batteries", default="1,5,10,15", help="battery counts to sweep")
+    parser.add_argument("--frames", type=int, default=100, help="timed frames per count")
+    parser.add_argument("--model", action="store_true", help="run the configured model instead of ColorBackend")
+    parser.add_argument("--battery", default="x".join(map(str, BATTERY_MM)), help="sprite size in mm, long x short")
+    parser.add_argument("--size", default="640x480", help="frame size the calib file is for")
+    args = parser.parse_args()
+
+    battery_mm = tuple(map(float, args.battery.split("x")))
+    size = tuple(map(int, args.size.split("x")))
+    mode = "tray_view" if cfg["tray_view"] else "points" if cfg["undistort_points"] else "remap"
+    print(f"{cfg['camera_calib']} {size[0]}x{size[1]}, {mode}, roi_crop {cfg['roi_crop']}, mask_moments {cfg['mask_moments']}, "
+          f"{'model ' + cfg['detect_model'] if args.model else 'ColorBackend'}, {args.frames} frames\n")
+    print(f"{'placed':>6}{'found':>7}{'fps':>7}{'p50 ms':>8}{'p95 ms':>8}"
+          f"{'centre mm (mean/max)':>22}{'angle deg (mean/max)':>22}{'H err mm (mean/max)':>22}")
+    for n in (int(v) for v in args.batteries.split(",")):
+        r = run(n, args.frames, args.model, battery_mm, size, cfg)
+        print(f"{r['placed']:>6}{r['found']:>7.1f}{r['fps']:>7.1f}{r['p50']:>8.2f}{r['p95']:>8.2f}"
+              f"{'%.2f / %.2f' % r['centre']:>22}{'%.2f / %.2f' % r['angle']:>22}{'%.2f / %.2f' % r['h_err']:>22}")
@@ -0,0 +1,114 @@
+# ------------------------------------------------------------------
+#  Sweep of the detection thread budget (userConfig `threads.detect`)
+#  python -m bench.thread_budget --video recordings/tray01.avi [--frames 150] [--cores 2,3]
+# ------------------------------------------------------------------
+# Every candidate (model threads x cv2 threads) runs in a fresh process, torch only takes
+# set_num_interop_threads once per process. Each one replays the recording through
+# BatteryLocator.update() (no grabber, no motion gate) and reports the per-frame latency;
+# the table is sorted by p95 since jitter is what hurts the arm, not the mean.
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+import engine.loader as ldr
+
+
+def powers_up_to(n):
+    out, v = [], 1
+    while v < n:
+        out.append(v)
+        v *= 2
+    return out + [n]
+
+
+def run_candidate(video, budget, frames, out_q):
+    from engine.threads import apply_thread_budget
+    apply_thread_budget("detect", cfg={"detect": budget})
+    from engine.detection import BatteryLocator
+    from engine.replay import ReplayCapture
+
+    cfg = ldr.usr_cfg["cam_pos"]
+    bl = BatteryLocator({**cfg, "grab_thread": 0, "motion_gate": 0, "profile": 0},
+                        cap=ReplayCapture(video, loop=True))
+    lat = []
+    try:
+        for i in range(frames + 10):
+            t = time.perf_counter()
+            bl.update()
+            if i >= 10:  # warm-up
+                lat.append((time.perf_counter() - t) * 1e3)
+    finally:
+        bl.release()
+    out_q.put(lat)
+
+
+def collect(p, q, timeout):
+    """Latencies of candidate process p, None when it died or ran past timeout (s)"""
+    t0 = time.monotonic()
+    while True:
+        try:
+            return q.get(timeout=1.0)
+        except queue.Empty:
+            if not p.is_alive():  # crashed before putting its result (bad core id, camera / model error)
+                try:
+                    return q.get(timeout=1.0)  # put just before it exited
+                except queue.Empty:
+                    return None
+            if time.monotonic() - t0 > timeout:
+                p.terminate()
+                return None
+
+
+def sweep(video, frames, cores, threads, cv2_threads, timeout=300.0):
+    ctx = mp.get_context("spawn")
+    results = []
+    for t in threads:
+        for c in cv2_threads:
+            budget = {"torch": t, "interop": 1, "onnx": t, "cv2": c, "cores": cores}
+            q = ctx.Queue()
+            p = ctx.Process(target=run_candidate, args=(video, budget, frames, q))
+            p.start()
+            lat = collect(p, q, timeout)
+            p.join()
+            if lat is None:
+                print(f"  model {t:>2}  cv2 {c:>2}   failed (exit code {p.exitcode})")
+                continue
+            lat = np.array(lat)
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            results.append((t, c, p50, p95, p99, lat.std()))
+            print(f"  model {t:>2}  cv2 {c:>2}   p50 {p50:6.1f}  p95 {p95:6.1f}  p99 {p99:6.1f}  "
+                  f"std {lat.std():5.1f} ms")
+    return sorted(results, key=lambda r: r[3])
+
+
+if __name__ == "__main__":
+    ncpu = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    parser = argparse.ArgumentParser(description="Find the best detection thread budget on this machine")
+    parser.add_argument("--video", required=True, help="recording from `python -m engine.replay record`")
+    parser.add_argument("--frames", type=int, default=150, help="timed frames per candidate")
+    parser.add_argument("--cores", default="", help="pin the detection worker, e.g. 2,3 (threads.detect.cores)")
+    parser.add_argument("--threads", default="", help="model threads to try, default 1,2,4..ncpu")
+    parser.add_argument("--cv2", default="1,2,0", help="cv2 threads to try, 0 = OpenCV default")
+    parser.add_argument("--timeout", type=float, default=300.0, help="s per candidate before it counts as failed")
+    args = parser.parse_args()
+
+    cores = [int(c) for c in args.cores.split(",") if c]
+    limit = len(cores) or ncpu
+    threads = [int(t) for t in args.threads.split(",") if t] or powers_up_to(limit)
+    cv2_threads = [int(c) for c in args.cv2.split(",") if c]
+
+    print(f"{ncpu} CPUs, cores {cores or 'all'}, {len(threads) * len(cv2_threads)} candidates\n")
+    best = sweep(args.video, args.frames, cores, threads, cv2_threads, args.timeout)
+    if not best:
+        sys.exit("Every candidate failed")
+    print("\nBest 3 by p95:")
+    for t, c, p50, p95, p99, std in best[:3]:
+        print(f"  model {t:>2}  cv2 {c:>2}   p50 {p50:6.1f}  p95 {p95:6.1f}  p99 {p99:6.1f}  std {std:5.1f} ms")
+    t, c = best[0][:2]
+    print(f"\nuserConfig.yaml:\nthreads:\n  detect:\n    torch: {t}\n    interop: 1\n    onnx: {t}\n"
+          f"    cv2: {c}\n    cores: {cores}")
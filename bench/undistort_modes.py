@@ -0,0 +1,81 @@
+# ------------------------------------------------------------------
+#  Benchmark: full-frame undistort remap vs point-only undistortion
+#  python -m bench.undistort_modes [--calib calib_480.npz] [--batteries 12] [--repeat 100]
+# ------------------------------------------------------------------
+# Renders a raw camera frame of the tray (engine.synthetic: 4 Aruco tags + battery sprites
+# at known mm poses, distorted with the K/D of the calib file), then runs both
+# BatteryLocator paths on it:
+#   remap:  cv2.remap the whole frame, tags + masks in the undistorted image
+#   points: tags + masks on the raw frame, PointLens undistorts only corners / rect points
+# The battery labels are thresholded (ColorBackend) instead of running the model, so this
+# measures the geometry only: pose error against the ground truth (mm, deg) and the cost per frame.
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.geometry import rects_to_array, rects_to_mm
+from engine.homography import HomographyCache
+from engine.postprocess import MaskPostProcessor
+from engine.synthetic import ColorBackend, TrayScene, camera_view, pose_error, random_poses
+
+def run_path(name, raw, lens, maps, size, cfg, repeat):
+    """One pipeline, returns (det, {stage: ms per frame})"""
+    hom = HomographyCache(size, {**cfg, "h_cache": 0}, lens=lens)
+    post = MaskPostProcessor(size, close=cfg["mask_close"])
+    model = ColorBackend()
+    times = {"undistort": [], "aruco": [], "masks+mm": []}
+    det = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        frame = raw if lens is not None else cv2.remap(raw, *maps, cv2.INTER_LINEAR)
+        t1 = time.perf_counter()
+        ok = hom.solve(frame)
+        t2 = time.perf_counter()
+        if not ok:
+            raise RuntimeError(f"{name}: tags not found")
+        polys = [p.astype(np.int32) for p in model.predict(frame).polys]
+        kept, rects = post.process(polys, cfg["guard_px"])
+        det = rects_to_mm(rects_to_array(rects), np.zeros(len(kept), int), hom.H, lens)
+        t3 = time.perf_counter()
+        times["undistort"].append(t1 - t0)
+        times["aruco"].append(t2 - t1)
+        times["masks+mm"].append(t3 - t2)
+    return det, {k: np.median(v) * 1e3 for k, v in times.items()}
+
+
+if __name__ == "__main__":
+    cfg = ldr.usr_cfg["cam_pos"]
+    parser = argparse.ArgumentParser(description="Full-frame remap vs point-only undistortion")
+    parser.add_argument("--calib", default=cfg["camera_calib"], help="calib file in camera/calib")
+    parser.add_argument("--size", default="640x480", help="frame size the calib file is for")
+    parser.add_argument("--batteries", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    w, h = map(int, args.size.split("x"))
+    calib = np.load(ldr.camera_calib / args.calib)
+    K, D = calib["K"], calib["D"]
+    newK, _ = cv2.getOptimalNewCameraMatrix(K, D, (w, h), 0)
+    maps = cv2.initUndistortRectifyMap(K, D, None, newK, (w, h), cv2.CV_16SC2)
+
+    scene = TrayScene((w, h), cfg, calib=args.calib, H=camera_view((w, h), cfg))
+    lens = scene.lens
+    poses = random_poses(args.batteries, cfg)
+    scene.render(poses)
+    raw = scene.frame()  # with noise
+
+    print(f"{args.calib} {w}x{h}, {len(poses)} batteries, median of {args.repeat} frames\n")
+    print(f"{'path':<8}{'undistort':>11}{'aruco':>9}{'masks+mm':>10}{'total':>9}   "
+          f"{'centre err mm (mean/max)':>25}{'angle err deg (mean/max)':>26}{'found':>7}")
+    for name, path_lens in (("remap", None), ("points", lens)):
+        det, t = run_path(name, raw, path_lens, maps, (w, h), cfg, args.repeat)
+        ce, ae = pose_error(det, poses)
+        total = sum(t.values())
+        err = f"{ce.mean():.2f} / {ce.max():.2f}" if len(ce) else "-"
+        aerr = f"{ae.mean():.2f} / {ae.max():.2f}" if len(ae) else "-"
+        print(f"{name:<8}{t['undistort']:>9.2f}ms{t['aruco']:>7.2f}ms{t['masks+mm']:>8.2f}ms"
+              f"{total:>7.2f}ms   {err:>25}{aerr:>26}{len(ce):>4}/{len(poses)}")
+    print("\naruco is a full solve per frame here, the station caches H (h_cache) and only checks it")
@@ -0,0 +1,210 @@
+# ------------------------------------------------------------------
+#  Camera sources: one place that opens cam_pos / cam_shot / the calibration camera
+# ------------------------------------------------------------------
+# python -m engine.camera [--cam cam_pos] [--reprobe]   list the formats the device takes
+#
+# source: auto (V4L2 on Linux, DirectShow on Windows), v4l2, dshow, msmf, file (a video or
+# a recording, engine.replay) or synthetic (engine.synthetic). Device sources get the
+# configured fourcc / width / height / fps / buffer_size. The formats a device really
+# delivers are probed once and cached per device in camera/probe_cache.json, later opens
+# ask straight for the closest supported one instead of negotiating again.
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import cv2
+
+import engine.loader as ldr
+
+DEBUG = ldr.usr_cfg["main"]["debug"]
+
+PROBE_CACHE = ldr.PROJECT_ROOT / "camera" / "probe_cache.json"
+APIS = {"v4l2": cv2.CAP_V4L2, "dshow": cv2.CAP_DSHOW, "msmf": cv2.CAP_MSMF}
+PROBE_SIZES = [(640, 480), (800, 600), (1280, 720), (1600, 1200), (1920, 1080)]
+PROBE_FOURCCS = ["MJPG", "YUYV"]
+SYNTHETIC_BATTERIES = 12
+SYNTHETIC_SHUFFLE = 90  # frames between new battery poses
+SWITCH_READS = 10  # reads to wait for the first frame of a new size after a mode switch
+
+
+def default_api() -> str:
+    if os.name == "nt":
+        return "dshow"
+    return "v4l2" if sys.platform.startswith("linux") else "any"
+
+
+def fourcc_str(code) -> str:
+    code = int(code)
+    return "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)).strip("\x00 ")
+
+
+def device_key(api, idx) -> str:
+    """Cache key of a device: api, index and, on Linux, the device name (USB port swaps)"""
+    name = ""
+    sysfs = Path(f"/sys/class/video4linux/video{idx}/name")
+    if api == "v4l2" and sysfs.exists():
+        name = sysfs.read_text(encoding="utf-8").strip()
+    return f"{api}:{idx}:{name}"
+
+
+# ------------------------------------------------------------------
+#  Probe cache
+# ------------------------------------------------------------------
+def load_probes(path=PROBE_CACHE) -> dict:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_probes(probes, path=PROBE_CACHE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(probes, indent=2), encoding="utf-8")
+
+
+def _set_format(cap, fourcc="", width=0, height=0, fps=0):
+    # V4L2 wants the pixel format before the size
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    if width and height:
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        cap.set(cv2.CAP_PROP_FPS, fps)
+
+
+def current_format(cap) -> dict:
+    return {"fourcc": fourcc_str(cap.get(cv2.CAP_PROP_FOURCC)),
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": round(cap.get(cv2.CAP_PROP_FPS), 2)}
+
+
+def probe(cap) -> list:
+    """Formats the opened device delivers: every PROBE_FOURCCS x PROBE_SIZES it accepts"""
+    modes = []
+    for fourcc in PROBE_FOURCCS:
+        for w, h in PROBE_SIZES:
+            _set_format(cap, fourcc, w, h)
+            ok, frame = cap.read()  # some drivers only switch on the next frame
+            got = current_format(cap)
+            if ok and frame.shape[1] == w and frame.shape[0] == h and got["fourcc"] == fourcc:
+                modes.append(got)
+    return modes
+
+
+def pick_mode(modes, fourcc="", width=0, height=0):
+    """
+    Supported mode closest to the request: same fourcc first, then the nearest size.
+    None without a size (0 = driver default), there is nothing to choose from the list then.
+    """
+    if not modes or not (width and height):
+        return None
+
+    def cost(m):
+        return (bool(fourcc) and m["fourcc"] != fourcc, abs(m["width"] * m["height"] - width * height))
+
+    return min(modes, key=cost)
+
+
+def device_modes(cap, api, idx, reprobe=False, path=PROBE_CACHE) -> list:
+    """Cached probe of the device, probed (a few seconds) only the first time or on reprobe"""
+    probes = load_probes(path)
+    key = device_key(api, idx)
+    if reprobe or key not in probes:
+        if DEBUG: print(f"Probing camera {key} ...")
+        probes[key] = probe(cap)
+        save_probes(probes, path)
+    return probes[key]
+
+
+def _read_size(cap, width, height, tries=SWITCH_READS):
+    for _ in range(tries):
+        ok, frame = cap.read()
+        if ok and frame.shape[1] == width and frame.shape[0] == height:
+            return frame
+    return None
+
+
+def grab_mode(cap, width, height):
+    """
+    One frame at width x height from an opened capture, switched back to its current size
+    after (the frames still queued at the big size are dropped). None when the source can't
+    switch (files, recordings). Nothing else may read cap meanwhile (FrameGrabber.lock).
+    """
+    w0, h0 = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame = None
+    if cap.set(cv2.CAP_PROP_FRAME_WIDTH, width) and cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height):
+        frame = _read_size(cap, width, height)
+    _set_format(cap, width=w0, height=h0)
+    _read_size(cap, w0, h0)
+    return frame
+
+
+# ------------------------------------------------------------------
+#  Open
+# ------------------------------------------------------------------
+def open_camera(cfg=ldr.usr_cfg["cam_pos"]):
+    """cv2.VideoCapture-like source for one camera section of userConfig (cam_pos, cam_shot)"""
+    source = cfg["source"]
+    if source == "file":
+        from engine.replay import ReplayCapture
+        return ReplayCapture(cfg["source_path"], realtime=True, loop=True)
+    if source == "synthetic":
+        from engine.synthetic import SyntheticCapture
+        # cam_pos also renders the refine size, so the coarse-to-fine pick runs on it too
+        modes = {(cfg["refine_width"], cfg["refine_height"]): cfg["refine_calib"]} if "refine" in cfg else None
+        return SyntheticCapture(SYNTHETIC_BATTERIES, (cfg["width"] or 640, cfg["height"] or 480), cfg,
+                                shuffle_every=SYNTHETIC_SHUFFLE, fps=cfg["fps"] or 30, modes=modes)
+
+    api = default_api() if source == "auto" else source
+    cap = cv2.VideoCapture(cfg["idx"], APIS.get(api, cv2.CAP_ANY))
+    if not cap.isOpened():
+        return cap
+    if cfg["buffer_size"]:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, cfg["buffer_size"])
+    fourcc, width, height, fps = cfg["fourcc"], cfg["width"], cfg["height"], cfg["fps"]
+    if width and height:
+        mode = pick_mode(device_modes(cap, api, cfg["idx"]), fourcc, width, height)
+        if mode is not None:
+            fourcc, width, height = mode["fourcc"], mode["width"], mode["height"]
+        _set_format(cap, fourcc, width, height, fps)
+        got = current_format(cap)
+        if (got["width"], got["height"]) != (width, height):
+            print(f"Camera {cfg['idx']}: asked {fourcc} {width}x{height}, got {got['fourcc']} "
+                  f"{got['width']}x{got['height']}")
+    elif fourcc or fps:  # driver default size: no probe, it would leave the last probed size set
+        _set_format(cap, fourcc, fps=fps)
+    if DEBUG: print(f"Camera {cfg['idx']} ({api}):", current_format(cap))
+    return cap
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe a camera of userConfig and show the formats it takes")
+    parser.add_argument("--cam", default="cam_pos", choices=["cam_pos", "cam_shot"])
+    parser.add_argument("--reprobe", action="store_true", help="ignore camera/probe_cache.json")
+    args = parser.parse_args()
+
+    cfg = ldr.usr_cfg[args.cam]
+    api = default_api() if cfg["source"] == "auto" else cfg["source"]
+    if api not in APIS and api != "any":
+        sys.exit(f"{args.cam}.source is {api}, nothing to probe")
+    cap = cv2.VideoCapture(cfg["idx"], APIS.get(api, cv2.CAP_ANY))
+    if not cap.isOpened():
+        sys.exit(f"Cannot open camera {cfg['idx']} ({api})")
+    try:
+        modes = device_modes(cap, api, cfg["idx"], args.reprobe)
+    finally:
+        cap.release()
+    print(f"{device_key(api, cfg['idx'])}: {len(modes)} formats")
+    for m in modes:
+        print(f"  {m['fourcc']} {m['width']}x{m['height']} @ {m['fps']:g} fps")
+    best = pick_mode(modes, cfg["fourcc"], cfg["width"], cfg["height"])
+    if best is None:
+        print(f"{args.cam} asks {cfg['fourcc'] or '-'} at the driver default size")
+    else:
+        print(f"{args.cam} asks {cfg['fourcc'] or '-'} {cfg['width']}x{cfg['height']} -> "
+              f"{best['fourcc']} {best['width']}x{best['height']}")
@@ -5,7 +5,32 @@ import time
 import cv2
 import numpy as np
 
-def calibrate_camera(reset_cam_flag, idx=0, checkerboard=(9, 6), square_size=19.0, num_images=20, save_path="./camera/calib/camera_calib_1080z.npz"):
+import engine.loader as ldr
+from engine.camera import open_camera
+
+
+def calib_size(path, cfg):
+    """
+    Capture size a calibration file is used at: cam_pos width x height for camera_calib,
+    refine_width x refine_height for refine_calib, (0, 0) = driver default for any other file
+    """
+    name = os.path.basename(str(path))
+    if name == cfg["camera_calib"]:
+        return cfg["width"], cfg["height"]
+    if name == cfg.get("refine_calib"):
+        return cfg["refine_width"], cfg["refine_height"]
+    return 0, 0
+
+
+def _open(idx, path, cfg):
+    # same source / fourcc as the running camera, at the size the calibration is for (K only holds there)
+    if cfg is None:
+        cfg = ldr.usr_cfg["cam_pos"]  # now, not at import: Settings reloads it
+    width, height = calib_size(path, cfg)
+    return open_camera({**cfg, "idx": idx, "width": width, "height": height})
+
+
+def calibrate_camera(reset_cam_flag, idx=0, checkerboard=(9, 6), square_size=19.0, num_images=20, save_path="./camera/calib/camera_calib_1080z.npz", cfg=None):
     objp = np.zeros((checkerboard[0]*checkerboard[1], 3), np.float32)
     objp[:, :2] = np.mgrid[0:checkerboard[0], 0:checkerboard[1]].T.reshape(-1, 2)
     objp *= square_size
@@ -13,7 +38,7 @@ def calibrate_camera(reset_cam_flag, idx=0, checkerboard=(9, 6), square_size=19.
     objpoints = []
     imgpoints = []
 
-    cap = cv2.VideoCapture(idx, cv2.CAP_DSHOW)
+    cap = _open(idx, save_path, cfg)
     collected = 0
     print("Starting calibration capture...")
 
@@ -65,7 +90,7 @@ def calibrate_camera(reset_cam_flag, idx=0, checkerboard=(9, 6), square_size=19.
     np.savez(save_path, K=K, D=D)
     print(f"💾 Saved calibration to: {save_path}")
 
-def open_undistorted_view(reset_cam_flag, idx=0, load_path="./camera/calib/camera_calib_1080z.npz"):
+def open_undistorted_view(reset_cam_flag, idx=0, load_path="./camera/calib/camera_calib_1080z.npz", cfg=None):
     # Load saved calibration
     try:
         data = np.load(load_path)
@@ -74,7 +99,7 @@ def open_undistorted_view(reset_cam_flag, idx=0, load_path="./camera/calib/camer
     except Exception as e:
         print(f"❌ Failed to load calibration data: {e}")
         return
-    cap = cv2.VideoCapture(idx, cv2.CAP_DSHOW)
+    cap = _open(idx, load_path, cfg)
     ret, frame = cap.read()
     if not ret:
         print("Failed to grab frame.")
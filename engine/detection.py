@@ -1,47 +1,40 @@
+import threading
 import time
 
 import cv2
-import cv2.aruco as aruco
 import numpy as np
-import torch
-from ultralytics import YOLO
 
 import engine.loader as ldr
+from engine.camera import open_camera
+from engine.homography import HomographyCache, tray_roi
+from engine.postprocess import MaskPostProcessor
+from engine.geometry import boxes_to_mm, empty_detections, rects_to_array, rects_to_mm
+from engine.render import OverlayRenderer
+from engine.grabber import FrameGrabber
+from engine.inference import shared_model
+from engine.motion import MotionGate
+from engine.pick import PICK_FIELDS
+from engine.profiler import NULL_TIMER, StageTimer
+from engine.trayview import TrayView
+from engine.undistort import PointLens
 
 DEBUG = ldr.usr_cfg["main"]["debug"]
-if DEBUG: print("Cuda available: ",torch.cuda.is_available())
-
-
-def tag_world_corners(tag_id: int, cfg=ldr.usr_cfg["cam_pos"]) -> np.ndarray:
-    if tag_id == 0:
-        base = (0, 0)
-    elif tag_id == 1:
-        base = (cfg["tray_length"], 0)
-    elif tag_id == 2:
-        base = (cfg["tray_length"], cfg["tray_width"])
-    elif tag_id == 3:
-        base = (0, cfg["tray_width"])
-    else:
-        raise ValueError("tag_id must be 0-3")
-
-    x0, y0 = base
-    s = cfg["tag_size"]
-    return np.array([[x0, y0 + s],  # TL
-                     [x0 + s, y0 + s],  # TR
-                     [x0 + s, y0],  # BR
-                     [x0, y0]],  # BL
-                    dtype=np.float32)
+
+READ_RETRY_S = 0.01  # back-off after a failed camera read (grab_thread off)
 
 
 class BatteryLocator:
-    def __init__(self, cfg=ldr.usr_cfg["cam_pos"]):
-        cfg = ldr.usr_cfg["cam_pos"]
+    def __init__(self, cfg=None, cap=None, model=None):
         self.stop = False
+        # read at call time: Settings reloads usr_cfg, a camera restart has to pick up the new calib / idx / model
+        cfg = ldr.usr_cfg["cam_pos"] if cfg is None else cfg
+        self.cfg = cfg
         # fix fisheye
         calib = np.load(ldr.camera_calib / cfg["camera_calib"])
         K, D = calib["K"], calib["D"]
 
-        self.cap = cv2.VideoCapture(cfg["idx"], cv2.CAP_DSHOW)
+        # cap: any cv2.VideoCapture-like source (ReplayCapture, SyntheticCapture), default cam_pos.source
+        self.cap = cap if cap is not None else open_camera(cfg)
         if not self.cap.isOpened():
             # raise RuntimeError("Cannot open camera", cfg["idx"])
             self.stop = True
@@ -61,155 +54,243 @@ class BatteryLocator:
             K, D, None, newK, (w, h), cv2.CV_16SC2)
         self.h_img, self.w_img = h, w
 
-        # detect aruco
-        self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
-        aruco_params = aruco.DetectorParameters()
-        aruco_params.cornerRefinementMethod = aruco.CORNER_REFINE_SUBPIX
-        aruco_params.cornerRefinementWinSize = 5
-        aruco_params.cornerRefinementMinAccuracy = 0.03
-        self.aruco_detector = aruco.ArucoDetector(self.aruco_dict, aruco_params)
+        # points mode: detect on the raw frame, undistort only tag corners and rect points
+        self.lens = None
+        if cfg["undistort_points"] and not cfg["tray_view"]:
+            self.lens = PointLens(K, D, newK)
+
+        # detect aruco, cached H between frames
+        self.homography = HomographyCache((w, h), cfg, lens=self.lens)
+        # tray view: raw frame -> top-down mm-scaled tray image in one remap, detection runs on that
+        self.tray_view = None
+        if cfg["tray_view"]:
+            self.tray_view = TrayView(K, D, newK, cfg)
+            w, h = self.tray_view.size
+            self.h_img, self.w_img = h, w
+        # mask -> rect, preallocated crops
+        self.post = MaskPostProcessor((w, h), close=cfg["mask_close"])
+        # overlay, drawn only for the frames that are shown
+        self.renderer = OverlayRenderer((w, h), cfg["preview_fps"])
+        # skip the model while the tray does not change
+        self.gate = MotionGate((w, h), cfg, lens=self.lens) if cfg["motion_gate"] else None
+        # per-stage timings, NULL_TIMER does nothing
+        self.timer = StageTimer() if cfg["profile"] else NULL_TIMER
 
-        # ---- YOLO model ----------------------------------------
-        self.model = YOLO(ldr.detect_model / cfg["detect_model"])
+        # ---- YOLO model (torch / onnx backend) ------------------
+        # loaded + warmed once per process (preloaded during the splash), reused on camera restarts;
+        # model: any backend with the same predict() (engine.synthetic.ColorBackend), nothing loaded then
+        self.model = shared_model(cfg) if model is None else model
         self.H = None
-        self.last_detections = []  # list of (X,Y,theta)
+        self.last_detections = empty_detections()  # DET_DTYPE array: x_mm, y_mm, theta, cls, conf
+        self.last_rects = None  # minAreaRects of the last frame (masks)
+        self.last_boxes = None  # xyxy boxes of the last frame (no masks)
+        self.last_crops = None  # mask crops of the last frame, None: the live post.crops (serial update)
+        self.pipeline = None  # engine.pipeline.DetectionPipeline driving this locator, if any
+        self.names = {}
         self._last_frame = None
         self.prev_frame_time = 0
         self.new_frame_time = 0
+        self.fps = 0.0
+        self.frame_seq = 0  # sequence number of the frame in last_detections
+        self.frame_ts = 0.0  # time.monotonic() it was grabbed at
+        self.frame_age = 0.0  # grab -> detection done, s
+        self.fresh = False  # last_detections come from this frame (False: reused, tray unchanged)
+
+        # ---- capture thread, always hands out the newest frame ----
+        self.grabber = None
+        if cfg["grab_thread"]:
+            self.grabber = FrameGrabber(self.cap, name="CamPosGrabber")
+            self.grabber.start()
+        # other users of the camera / model (engine.refine) hold these, the pipeline threads share them too
+        self.cap_lock = self.grabber.lock if self.grabber is not None else threading.Lock()
+        self.model_lock = threading.Lock()
+
+    def _read(self):
+        """(ok, raw, seq, timestamp) of the next frame"""
+        if self.grabber is not None:
+            return self.grabber.read()
+        with self.cap_lock:
+            ok, raw = self.cap.read()
+        if not ok:
+            time.sleep(READ_RETRY_S)  # no grabber to wait on, don't let the caller spin
+        return ok, raw, self.frame_seq + 1, time.monotonic()
+
+    def _tick_fps(self):
+        self.new_frame_time = time.time()
+        if (self.new_frame_time - self.prev_frame_time) > 0:
+            self.fps = 1 / (self.new_frame_time - self.prev_frame_time)
+        else:
+            self.fps = 0.0
+        self.prev_frame_time = self.new_frame_time
 
-    def _compute_homography(self, frame, cfg=ldr.usr_cfg["cam_pos"]):
-        img_pts, obj_pts = [], []
-        corners, ids, _ = self.aruco_detector.detectMarkers(frame)
-        if ids is not None:
-            for tid, c4 in zip(ids.flatten(), corners):
-                if tid in cfg["tag_ids"]:
-                    pts4 = c4[0].astype(np.float32)
-                    img_pts.extend(pts4)
-                    obj_pts.extend(tag_world_corners(tid))
-                    # draw tag border
-                    cv2.polylines(frame, [pts4.astype(int)],
-                                  True, (0, 255, 0), 2)
-        if len(img_pts) >= 4:
-            self.H, _ = cv2.findHomography(np.array(img_pts),
-                                           np.array(obj_pts),
-                                           cv2.RANSAC, 2.0)
+    @property
+    def dropped_frames(self):
+        return self.grabber.dropped if self.grabber is not None else 0
+
+    def _compute_homography(self, frame, cfg=None):
+        self.H = self.homography.update(frame)
+
+    def _tray_roi(self, cfg=None, H=None):
+        """Bounding box (x0, y0, x1, y1) of the tray in the image, None if H is unknown"""
+        return tray_roi(self.H if H is None else H, (self.w_img, self.h_img), cfg or self.cfg, self.lens)
+
+    def _predict(self, frame, cfg=None, H=None):
+        """Run YOLO on the tray crop (or the whole frame), return polys/boxes/rects in full-frame px + scores"""
+        cfg = cfg or self.cfg
+        roi = self._tray_roi(cfg, H) if cfg["roi_crop"] else None
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            with self.model_lock:
+                result = self.model.predict(frame[y0:y1, x0:x1], cfg["conf"], imgsz=cfg["roi_imgsz"])
+            offset = np.array([x0, y0], np.float32)
+        else:
+            with self.model_lock:
+                result = self.model.predict(frame, cfg["conf"])
+            offset = np.zeros(2, np.float32)
+
+        polys = rects = None
+        if result.rects is not None:  # mask_moments: rects measured on the low-res masks
+            rects = result.rects.copy()
+            rects[:, :2] += offset
+        elif result.polys is not None:
+            polys = [(p + offset).astype(np.int32) for p in result.polys]
+        boxes = result.boxes + np.tile(offset, 2)
+        return polys, boxes, result.classes, result.names, rects, result.scores
 
     def _angle_table(self, rect):
         if self.H is None:
             return 0.0
-        box = cv2.boxPoints(rect).astype(np.float32)
-        edges = [np.linalg.norm(box[i] - box[(i + 1) % 4]) for i in range(4)]
-        i0 = int(np.argmax(edges))
-        i1 = (i0 + 1) % 4
-        p_img = np.array([[box[i0], box[i1]]], np.float32)
-        p_mm = cv2.perspectiveTransform(p_img, self.H)[0]
-        dx, dy = p_mm[1] - p_mm[0]
-        return (np.degrees(np.arctan2(dy, dx)) + 360) % 180
-
-    def update(self, cfg=ldr.usr_cfg["cam_pos"]):
-        if self.cap.isOpened():
-            ok, raw = self.cap.read()
-            self.new_frame_time = time.time()
-            if (self.new_frame_time - self.prev_frame_time) > 0:
-                fps = 1 / (self.new_frame_time - self.prev_frame_time)
-            else:
-                fps = 0.0
-
-            if not ok:
-                self.last_detections = []
-                return None
+        return float(rects_to_mm(rects_to_array([rect]), [0], self.H, self.lens)["theta"][0])
 
+    # ------------------------------------------------------------------
+    #  The stages of update(), also run on their own threads by engine.pipeline
+    # ------------------------------------------------------------------
+    def _prepare(self, raw, timer=NULL_TIMER):
+        """Undistort / tray view + homography: (frame, H), frame is None while the tray view has no H"""
+        if self.lens is not None:
+            frame = raw  # stays distorted, rects/tags are corrected point by point
+            H = self.homography.update(frame)
+            timer.mark("homography")
+        elif self.tray_view is None:
             frame = cv2.remap(raw, self.map1, self.map2, cv2.INTER_LINEAR)
-            self._last_frame = frame.copy()  # ensure something to show
-            self._compute_homography(frame)
-
-            det = []
-            result = self.model.predict(frame, conf=cfg["conf"], verbose=False)[0]
-
-            # -------- choose masks if present, else boxes -----------
-            if result.masks is not None:
-                polys = [p.astype(np.int32) for p in result.masks.xy]
-                for idx, cnt in enumerate(polys):
-                    if (cnt[:, 0] < cfg["guard_px"]).any() or \
-                            (cnt[:, 0] > self.w_img - cfg["guard_px"]).any() or \
-                            (cnt[:, 1] < cfg["guard_px"]).any() or \
-                            (cnt[:, 1] > self.h_img - cfg["guard_px"]).any():
-                        continue
-                    mask = np.zeros((self.h_img, self.w_img), np.uint8)
-                    cv2.fillPoly(mask, [cnt], 255)
-                    mask = cv2.morphologyEx(
-                        mask, cv2.MORPH_CLOSE,
-                        cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
-                    cnt2, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL,
-                                               cv2.CHAIN_APPROX_SIMPLE)
-                    rect = cv2.minAreaRect(cnt2[0])
-                    (xc, yc), (wr, hr), _ = rect
-                    if self.H is None: continue
-                    p_img = np.array([[[xc, yc]]], np.float32)
-                    X_mm, Y_mm = cv2.perspectiveTransform(p_img, self.H)[0, 0]
-                    theta = self._angle_table(rect)
-                    label = result.names[int(result.boxes.cls[idx])]
-                    det.append((X_mm, Y_mm, theta,int(result.boxes.cls[idx])))
-                    # fps
-
-
-                    # draw
-                    if cfg["show_masks"]:
-                        overlay = frame.copy()
-                        overlay[mask.astype(bool)] = (0, 0, 200)
-                        cv2.addWeighted(overlay, 0.35, frame, 0.65, 0, frame)
-                        cv2.drawContours(frame, [cv2.boxPoints(rect).astype(int)],
-                                         -1, (0, 100, 255), 1)
-                    cv2.circle(frame, (int(xc), int(yc)), 2, (0, 255, 255), -1)
-                    cv2.putText(frame, label, (int(xc) -20, int(yc) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.42, (100, 255, 100), 1,cv2.LINE_AA)
-                    cv2.putText(frame, f"X:{X_mm:.0f}",
-                                (int(xc) -20, int(yc)),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.42, (255, 255, 0), 1,cv2.LINE_AA)
-                    cv2.putText(frame, f"Y:{Y_mm:.0f}",
-                                (int(xc) -20, int(yc)+10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.42, (255, 255, 0), 1,cv2.LINE_AA)
-                    cv2.putText(frame, f"{theta:.0f}'",
-                                (int(xc) -20, int(yc) + 20),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.42, (0, 255, 255), 1,cv2.LINE_AA)
-
-        else:  # ---------- fallback to boxes --------------------
-            for box in result.boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
-                if self.H is None: continue
-                p_img = np.array([[[cx, cy]]], np.float32)
-                X_mm, Y_mm = cv2.perspectiveTransform(p_img, self.H)[0, 0]
-                theta = 0.0
-                cv2.rectangle(frame, (int(x1), int(y1)),
-                              (int(x2), int(y2)), (0, 100, 255), 2)
-                cv2.circle(frame, (int(cx), int(cy)), 3, (0, 255, 255), -1)
-                cv2.putText(frame, f"{X_mm:.1f},{Y_mm:.1f}",
-                            (int(cx) + 6, int(cy)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
-                det.append((X_mm, Y_mm, theta))
-
-        self.last_detections = det
-        self._last_frame = frame  # annotated copy
-        cv2.putText(frame, f"FPS: {int(fps + 0)}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2,
-                    cv2.LINE_AA)
-        self.prev_frame_time = self.new_frame_time
+            timer.mark("remap")
+            H = self.homography.update(frame)
+            timer.mark("homography")
+        else:
+            # the undistorted frame is only built when the tag check / solve needs it
+            H_cam = self.homography.update(lambda: cv2.remap(raw, self.map1, self.map2, cv2.INTER_LINEAR))
+            timer.mark("homography")
+            frame = self.tray_view.warp(raw, H_cam)
+            timer.mark("remap")
+            H = self.tray_view.H if frame is not None else None  # tray view px -> mm
+        return frame, H
+
+    def _postprocess(self, polys, boxes, classes, H, cfg=None, mask_rects=None, scores=None):
+        """Masks (mask rects, else boxes) -> (DET_DTYPE detections, rects, boxes)"""
+        cfg = cfg or self.cfg
+        det = empty_detections()
+        rects = None
+        # the tray view border is the tray outline, not a frame edge cutting batteries off
+        guard = 0 if self.tray_view is not None else cfg["guard_px"]
+        if mask_rects is not None:
+            kept, rects = self.post.process_rects(mask_rects, guard)
+        elif polys is not None:
+            kept, rects = self.post.process(polys, guard)
+        if rects is not None:
+            if H is not None:
+                det = rects_to_mm(rects_to_array(rects), classes[kept], H, self.lens,
+                                  None if scores is None else scores[kept])
+            boxes = None
+        elif H is not None:  # ---------- fallback to boxes --------------------
+            det = boxes_to_mm(boxes, classes, H, self.lens, scores)
+        return det, rects, boxes
+
+    def update(self, cfg=None):
+        """Detection only: reads a frame, updates last_detections, returns the undistorted frame"""
+        cfg = cfg or self.cfg
+        if not self.cap.isOpened():
+            return None
+        timer = self.timer
+        timer.begin()
+        ok, raw, self.frame_seq, self.frame_ts = self._read()
+        timer.mark("read")
+        self._tick_fps()
+
+        if not ok:
+            self.last_detections = empty_detections()
+            return None
+
+        frame, H = self._prepare(raw, timer)
+        if frame is None:  # tray view: tags not found yet, no tray to look at
+            self.last_detections = empty_detections()
+            return None
+        self.H = H
+        self._last_frame = frame
+
+        if self.gate is not None:
+            moved = self.gate.changed(frame, self.H)
+            timer.mark("gate")
+            if not moved:
+                # nothing moved on the tray, keep last_detections/rects
+                self.fresh = False
+                self.frame_age = time.monotonic() - self.frame_ts
+                return frame
+        t0 = time.perf_counter()
+
+        polys, boxes, classes, self.names, mask_rects, scores = self._predict(frame, cfg, H)
+        timer.mark("predict")
+
+        # -------- choose masks if present, else boxes -----------
+        self.last_detections, self.last_rects, self.last_boxes = self._postprocess(polys, boxes, classes, H, cfg,
+                                                                                   mask_rects, scores)
+        self.last_crops = None  # post.crops of this frame
+        self.fresh = True
+        timer.mark("post")
+        if self.gate is not None:
+            self.gate.ran(time.perf_counter() - t0)
+        self.frame_age = time.monotonic() - self.frame_ts
         return frame
 
+    def render(self, cfg=None):
+        """Overlay of the last update() on a copy of its frame, only call it for frames that are shown"""
+        cfg = cfg or self.cfg
+        if self._last_frame is None:
+            return None
+        self.timer.begin()
+        canvas = self.renderer.draw(self._last_frame, self.last_detections, self.names,
+                                    rects=self.last_rects, boxes=self.last_boxes, fps=self.fps,
+                                    show_masks=cfg["show_masks"], post=self.post, crops=self.last_crops,
+                                    homography=self.homography if self.tray_view is None else None,
+                                    info=self._debug_info() if DEBUG else "")
+        self.timer.mark("draw")
+        return canvas
+
+    def _debug_info(self):
+        info = f"lag: {self.frame_age * 1e3:.0f}ms drop: {self.dropped_frames}"
+        if self.gate is not None:
+            info += " " + self.gate.info()
+        if self.pipeline is not None:
+            info += " " + self.pipeline.info()
+        return info
+
     def get_nearest_battery(self, ref=(0, 0)):
-        if not self.last_detections:
+        det = self.last_detections
+        if len(det) == 0:
             return None
-        closest_detection = min(self.last_detections,
-                                key=lambda t_val: (t_val[0] - ref[0]) ** 2 + (t_val[1] - ref[1]) ** 2)
+        i = np.argmin((det["x_mm"] - ref[0]) ** 2 + (det["y_mm"] - ref[1]) ** 2)
 
-        # Convert all elements in the returned detection to standard Python floats
-        return tuple(int(val) for val in closest_detection)
+        # Convert x, y, theta, cls of the returned detection to standard Python ints
+        return tuple(int(det[i][f]) for f in PICK_FIELDS)
 
     def show(self, win="Battery Cam"):
-        if self._last_frame is not None:
-            cv2.imshow(win, self._last_frame)
+        frame = self.render()
+        if frame is not None:
+            cv2.imshow(win, frame)
             cv2.waitKey(1)
 
     def release(self):
+        if self.grabber is not None:
+            self.grabber.stop()
         self.cap.release()
         cv2.destroyAllWindows()
 
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+
+# One row per battery, tray mm / degrees, what BatteryLocator.last_detections holds
+DET_DTYPE = np.dtype([("x_mm", np.float32),
+                      ("y_mm", np.float32),
+                      ("theta", np.float32),  # long edge angle on the tray, [0, 180)
+                      ("cls", np.int32),
+                      ("conf", np.float32)])  # model confidence
+
+
+def empty_detections() -> np.ndarray:
+    return np.empty(0, DET_DTYPE)
+
+
+def rects_to_array(rects) -> np.ndarray:
+    """[((cx, cy), (w, h), angle), ...] from cv2.minAreaRect -> (N, 5) float32"""
+    if len(rects) == 0:
+        return np.empty((0, 5), np.float32)
+    return np.array([(c[0], c[1], s[0], s[1], a) for c, s, a in rects], np.float32)
+
+
+def rect_long_edges(rects: np.ndarray):
+    """
+    Vectorised cv2.boxPoints: returns the two image points of the long edge of every rect
+    (the same edge _angle_table used to pick with argmax over the 4 box edges).
+    """
+    cx, cy, w, h, ang = rects.T
+    a = np.sin(np.radians(ang)) * 0.5
+    b = np.cos(np.radians(ang)) * 0.5
+    p0 = np.stack([cx - a * h - b * w, cy + b * h - a * w], axis=1)
+    p1 = np.stack([cx + a * h - b * w, cy - b * h - a * w], axis=1)
+    p2 = np.stack([2 * cx, 2 * cy], axis=1) - p0
+    # |p0p1| == h, |p1p2| == w, ties go to p0p1 like np.argmax
+    long_h = (h >= w)[:, None]
+    return np.where(long_h, p0, p1), np.where(long_h, p1, p2)
+
+
+def rects_to_mm(rects: np.ndarray, classes, H, lens=None, scores=None) -> np.ndarray:
+    """
+    Centres and long-edge angles of all rects (N, 5) through H in a single
+    perspectiveTransform call. classes / scores: (N,) class id / confidence per rect (1 if None).
+    lens: PointLens when the rects are in the raw frame, only these 3N points get undistorted.
+    """
+    n = len(rects)
+    det = np.empty(n, DET_DTYPE)
+    if n == 0:
+        return det
+    e0, e1 = rect_long_edges(rects)
+    pts = np.concatenate([rects[:, :2], e0, e1]).astype(np.float32)
+    if lens is not None:
+        pts = lens.undistort(pts)
+    mm = cv2.perspectiveTransform(pts[None], H)[0]
+    centre, m0, m1 = mm[:n], mm[n:2 * n], mm[2 * n:]
+    d = m1 - m0
+    det["x_mm"] = centre[:, 0]
+    det["y_mm"] = centre[:, 1]
+    det["theta"] = (np.degrees(np.arctan2(d[:, 1], d[:, 0])) + 360) % 180
+    det["cls"] = classes
+    det["conf"] = 1.0 if scores is None else scores
+    return det
+
+
+def boxes_to_mm(boxes: np.ndarray, classes, H, lens=None, scores=None) -> np.ndarray:
+    """Axis aligned xyxy boxes (N, 4): centre through H, no angle"""
+    det = np.zeros(len(boxes), DET_DTYPE)
+    if len(boxes) == 0:
+        return det
+    centre = ((boxes[:, :2] + boxes[:, 2:]) / 2).astype(np.float32)
+    if lens is not None:
+        centre = lens.undistort(centre)
+    mm = cv2.perspectiveTransform(centre[None], H)[0]
+    det["x_mm"] = mm[:, 0]
+    det["y_mm"] = mm[:, 1]
+    det["cls"] = classes
+    det["conf"] = 1.0 if scores is None else scores
+    return det
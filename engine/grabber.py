@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Drains a cv2.VideoCapture-like source on its own thread into a single-slot buffer,
+    so the camera's internal queue never fills up and the consumer always gets the newest
+    frame. Every frame gets a sequence number and a time.monotonic() timestamp; frames
+    the consumer never took are counted in `dropped`. Hold `lock` to use cap from another
+    thread (mode switch of engine.camera.grab_mode), the grabber waits meanwhile.
+    """
+
+    def __init__(self, cap, name="FrameGrabber"):
+        super().__init__(name=name, daemon=True)
+        self.cap = cap
+        self._cond = threading.Condition()
+        self.lock = threading.Lock()  # held around every cap.read()
+        self._running = True
+        self._frame = None
+        self.seq = 0  # last grabbed frame
+        self.timestamp = 0.0  # time.monotonic() of the last grabbed frame
+        self.taken = 0  # last frame handed to the consumer
+        self.dropped = 0
+
+    def run(self):
+        while self._running and self.cap.isOpened():
+            with self.lock:
+                ok, frame = self.cap.read()
+            ts = time.monotonic()
+            if ok:
+                with self._cond:
+                    self._frame = frame
+                    self.seq += 1
+                    self.timestamp = ts
+                    self._cond.notify_all()
+            else:
+                time.sleep(0.01)  # unplugged / not ready, don't spin
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def read(self, timeout=1.0):
+        """
+        Newest frame not returned before: (ok, frame, seq, timestamp). Waits up to timeout for
+        it, also while the camera fails, so a consumer looping on read() doesn't spin.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > self.taken or not self._running, timeout)
+            if self.seq == self.taken:  # timed out / stopped, nothing new
+                return False, None, self.taken, self.timestamp
+            self.dropped += self.seq - self.taken - 1
+            self.taken = self.seq
+            return True, self._frame, self.seq, self.timestamp
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=1.0)
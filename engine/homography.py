@@ -0,0 +1,238 @@
+import time
+from pathlib import Path
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+import engine.loader as ldr
+
+DEBUG = ldr.usr_cfg["main"]["debug"]
+
+H_CACHE_SUFFIX = ".homography.npz"
+LOST_CHECKS = 3  # drift checks in a row without a single tag in its ROI before a full re-solve
+
+
+def tag_world_corners(tag_id: int, cfg=ldr.usr_cfg["cam_pos"]) -> np.ndarray:
+    if tag_id == 0:
+        base = (0, 0)
+    elif tag_id == 1:
+        base = (cfg["tray_length"], 0)
+    elif tag_id == 2:
+        base = (cfg["tray_length"], cfg["tray_width"])
+    elif tag_id == 3:
+        base = (0, cfg["tray_width"])
+    else:
+        raise ValueError("tag_id must be 0-3")
+
+    x0, y0 = base
+    s = cfg["tag_size"]
+    return np.array([[x0, y0 + s],  # TL
+                     [x0 + s, y0 + s],  # TR
+                     [x0 + s, y0],  # BR
+                     [x0, y0]],  # BL
+                    dtype=np.float32)
+
+
+def tray_world_corners(cfg=ldr.usr_cfg["cam_pos"]) -> np.ndarray:
+    # Outer corners of the tag-bounded tray in mm (TL, TR, BR, BL of tag_world_corners order)
+    L = cfg["tray_length"] + cfg["tag_size"]
+    W = cfg["tray_width"] + cfg["tag_size"]
+    return np.array([[0, 0], [L, 0], [L, W], [0, W]], dtype=np.float32)
+
+
+def same_h(H0, H1, cfg=ldr.usr_cfg["cam_pos"]) -> bool:
+    """
+    H0 and H1 (image px -> tray mm) put the tray corners within h_drift_px of each other, the
+    same tolerance the drift check re-solves at. By value: with h_cache off every frame brings
+    a new, slightly noisy H array.
+    """
+    if H0 is None or H1 is None:
+        return H0 is H1
+    if H0 is H1:
+        return True
+    corners = tray_world_corners(cfg)[None].astype(np.float64)
+    px0 = cv2.perspectiveTransform(corners, np.linalg.inv(H0))[0]
+    px1 = cv2.perspectiveTransform(corners, np.linalg.inv(H1))[0]
+    return float(np.abs(px0 - px1).max()) < cfg["h_drift_px"]
+
+
+def tray_roi(H, frame_size, cfg=ldr.usr_cfg["cam_pos"], lens=None):
+    """
+    Bounding box (x0, y0, x1, y1) of the tray in the image, padded by roi_margin_px, None if H is unknown.
+    lens: PointLens when the image is the raw (distorted) frame
+    """
+    if H is None:
+        return None
+    w_img, h_img = frame_size
+    corners = cv2.perspectiveTransform(tray_world_corners(cfg)[None], np.linalg.inv(H))[0]
+    if lens is not None:
+        corners = lens.distort(corners)
+    x, y, w, h = cv2.boundingRect(corners)
+    m = cfg["roi_margin_px"]
+    x0, y0 = max(x - m, 0), max(y - m, 0)
+    x1, y1 = min(x + w + m, w_img), min(y + h + m, h_img)
+    if x1 - x0 < 32 or y1 - y0 < 32:  # tray out of view, bad H
+        return None
+    return x0, y0, x1, y1
+
+
+def h_cache_path(calib_file) -> Path:
+    """camera/calib/calib_480.npz -> camera/calib/calib_480.homography.npz"""
+    calib_file = Path(calib_file)
+    return calib_file.with_name(calib_file.stem + H_CACHE_SUFFIX)
+
+
+class HomographyCache:
+    """
+    Keeps the tray homography (undistorted image px -> tray mm) between frames.
+    The tray and camera are bolted down, so the full subpixel Aruco + RANSAC solve
+    only runs when the cached H is missing, too old (h_resolve_s) or when a cheap
+    check on the last known tag ROIs sees the corners drift more than h_drift_px.
+    Every successful solve is saved next to the calibration file.
+    With a PointLens the tags are found on the raw frame and only their corners are
+    undistorted, H stays undistorted px -> mm either way.
+    """
+
+    def __init__(self, frame_size, cfg=ldr.usr_cfg["cam_pos"], lens=None):
+        self.cfg = cfg
+        self.lens = lens
+        self.w_img, self.h_img = frame_size
+        self.path = h_cache_path(ldr.camera_calib / cfg["camera_calib"])
+
+        self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+        # full solve: subpixel corners
+        aruco_params = aruco.DetectorParameters()
+        aruco_params.cornerRefinementMethod = aruco.CORNER_REFINE_SUBPIX
+        aruco_params.cornerRefinementWinSize = 5
+        aruco_params.cornerRefinementMinAccuracy = 0.03
+        self.aruco_detector = aruco.ArucoDetector(self.aruco_dict, aruco_params)
+        # drift check: no refinement, only runs on small crops
+        self.check_detector = aruco.ArucoDetector(self.aruco_dict, aruco.DetectorParameters())
+
+        self.H = None
+        self.tag_corners = {}  # tag id -> (4,2) image corners of the last solve (undistorted px)
+        self.tag_px = {}  # same corners in the frame given to update() (raw px with a lens)
+        self.last_solve = 0.0
+        self.frame_count = 0
+        self.drift_px = 0.0
+        self.tags_seen = 0  # tags re-detected by the last drift check
+        self.lost_checks = 0  # drift checks in a row that found no tag
+        if cfg["h_cache"]:
+            self.load()
+
+    # ------------------------------------------------------------------
+    #  Disk cache
+    # ------------------------------------------------------------------
+    def _geometry(self):
+        return np.array([self.cfg["tag_size"], self.cfg["tray_length"], self.cfg["tray_width"],
+                         self.w_img, self.h_img], np.float64)
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = np.load(self.path)
+            if not np.allclose(data["geometry"], self._geometry()):
+                if DEBUG: print("Homography cache does not match tray/camera, ignoring", self.path)
+                return
+            self.H = data["H"]
+            self.tag_corners = {int(tid): c for tid, c in zip(data["ids"], data["corners"])}
+            self.tag_px = {tid: self._to_frame(c) for tid, c in self.tag_corners.items()}
+            # verified by the drift check on the first frame
+            self.last_solve = time.monotonic()
+            if DEBUG: print("Homography loaded from", self.path)
+        except Exception as e:
+            print(f"Failed to load homography cache {self.path}: {e}")
+
+    def save(self):
+        try:
+            ids = sorted(self.tag_corners)
+            np.savez(self.path, H=self.H, ids=np.array(ids, np.int32),
+                     corners=np.array([self.tag_corners[i] for i in ids], np.float32),
+                     geometry=self._geometry())
+        except Exception as e:
+            print(f"Failed to save homography cache {self.path}: {e}")
+
+    # ------------------------------------------------------------------
+    #  Solve / check
+    # ------------------------------------------------------------------
+    def _undistort(self, pts):
+        return self.lens.undistort(pts) if self.lens is not None else pts
+
+    def _to_frame(self, pts):
+        return self.lens.distort(pts) if self.lens is not None else pts
+
+    def solve(self, frame) -> bool:
+        img_pts, obj_pts, tag_corners, tag_px = [], [], {}, {}
+        corners, ids, _ = self.aruco_detector.detectMarkers(frame)
+        if ids is not None:
+            for tid, c4 in zip(ids.flatten(), corners):
+                if tid in self.cfg["tag_ids"]:
+                    pts4 = self._undistort(c4[0].astype(np.float32))
+                    img_pts.extend(pts4)
+                    obj_pts.extend(tag_world_corners(tid, self.cfg))
+                    tag_corners[int(tid)] = pts4
+                    tag_px[int(tid)] = c4[0].astype(np.float32)
+        if len(img_pts) < 4:
+            return False
+        H, _ = cv2.findHomography(np.array(img_pts), np.array(obj_pts), cv2.RANSAC, 2.0)
+        if H is None:
+            return False
+        self.H = H
+        self.tag_corners = tag_corners
+        self.tag_px = tag_px
+        self.last_solve = time.monotonic()
+        self.drift_px = 0.0
+        self.lost_checks = 0
+        if self.cfg["h_cache"]:
+            self.save()
+        return True
+
+    def drift(self, frame) -> float:
+        """
+        Worst mean corner reprojection error (px) over the tags re-detected in their last ROIs,
+        how many were found goes to tags_seen (0: all occluded, or the camera / tray moved away)
+        """
+        H_inv = np.linalg.inv(self.H)
+        worst = 0.0
+        self.tags_seen = 0
+        for tid, c4 in self.tag_px.items():
+            x, y, w, h = cv2.boundingRect(c4)
+            pad = max(w, h) // 2 + 4
+            x0, y0 = max(x - pad, 0), max(y - pad, 0)
+            x1, y1 = min(x + w + pad, self.w_img), min(y + h + pad, self.h_img)
+            corners, ids, _ = self.check_detector.detectMarkers(frame[y0:y1, x0:x1])
+            if ids is None:
+                continue  # occluded by an arm, can't tell
+            for found_id, found in zip(ids.flatten(), corners):
+                if found_id != tid:
+                    continue
+                self.tags_seen += 1
+                seen = self._undistort(found[0] + np.array([x0, y0], np.float32))
+                expected = cv2.perspectiveTransform(
+                    tag_world_corners(tid, self.cfg)[None], H_inv)[0]
+                worst = max(worst, float(np.linalg.norm(seen - expected, axis=1).mean()))
+        return worst
+
+    def update(self, frame):
+        """frame: undistorted image, or a callable returning it (only called on frames that need it)"""
+        if self.H is None or not self.cfg["h_cache"]:
+            self.solve(frame() if callable(frame) else frame)
+        elif self.frame_count % self.cfg["h_check_frames"] == 0:
+            if callable(frame):
+                frame = frame()
+            expired = time.monotonic() - self.last_solve > self.cfg["h_resolve_s"]
+            if not expired:
+                self.drift_px = self.drift(frame)
+                self.lost_checks = self.lost_checks + 1 if self.tags_seen == 0 else 0
+            lost = self.lost_checks >= LOST_CHECKS  # bumped out of the ROIs, the drift can't tell
+            if expired or lost or self.drift_px > self.cfg["h_drift_px"]:
+                if DEBUG: print(f"Homography re-solve (expired={expired}, lost={lost}, drift={self.drift_px:.2f}px)")
+                self.solve(frame)
+        self.frame_count += 1
+        return self.H
+
+    def draw(self, frame):
+        for c4 in self.tag_px.values():
+            cv2.polylines(frame, [c4.astype(int)], True, (0, 255, 0), 2)
@@ -0,0 +1,410 @@
+import ast
+import hashlib
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.postprocess import moments_rect
+
+DEBUG = ldr.usr_cfg["main"]["debug"]
+
+EXPORT_TAG = ".export."  # camera/model/<stem>.export.<hash>.<imgsz>.<onnx|torchscript>, hidden from the model list
+WARMUP_RUNS = 3
+
+
+@dataclass
+class SegResult:
+    """What BatteryLocator needs from a model run, in pixels of the image given to predict()"""
+    polys: list = None  # float32 (K, 2) outline per detection, None if the model has no masks
+    boxes: np.ndarray = field(default_factory=lambda: np.empty((0, 4), np.float32))  # xyxy
+    scores: np.ndarray = field(default_factory=lambda: np.empty(0, np.float32))
+    classes: np.ndarray = field(default_factory=lambda: np.empty(0, int))
+    names: dict = field(default_factory=dict)
+    rects: np.ndarray = None  # (N, 5) cx, cy, long, short, angle from the low-res masks (mask_moments), no polys then
+
+
+def file_hash(path, n=12) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:n]
+
+
+def export_path(pt_path, imgsz, fmt="onnx") -> Path:
+    pt_path = Path(pt_path)
+    return pt_path.with_name(f"{pt_path.stem}{EXPORT_TAG}{file_hash(pt_path)}.{imgsz}.{fmt}")
+
+
+def export_model(pt_path, imgsz, fmt="onnx") -> Path:
+    """One-time ultralytics export of the .pt, cached next to it by file hash and input size"""
+    out = export_path(pt_path, imgsz, fmt)
+    if out.exists():
+        return out
+    print(f"Exporting {Path(pt_path).name} to {fmt} ({imgsz}px), only done once...")
+    from ultralytics import YOLO
+    kw = {"dynamic": False, "simplify": True} if fmt == "onnx" else {}
+    exported = YOLO(pt_path).export(format=fmt, imgsz=imgsz, **kw)  # fused, eval mode
+    shutil.move(exported, out)
+    return out
+
+
+def export_onnx(pt_path, imgsz) -> Path:
+    return export_model(pt_path, imgsz, "onnx")
+
+
+def letterbox(img, size, dst=None):
+    """Resize keeping the aspect ratio and pad to size x size (ultralytics LetterBox, pad 114)"""
+    h, w = img.shape[:2]
+    gain = min(size / h, size / w)
+    nw, nh = int(round(w * gain)), int(round(h * gain))
+    px, py = (size - nw) / 2, (size - nh) / 2
+    left, top = int(round(px - 0.1)), int(round(py - 0.1))
+    if dst is None:
+        dst = np.empty((size, size, 3), np.uint8)
+    dst[:] = 114
+    cv2.resize(img, (nw, nh), dst=dst[top:top + nh, left:left + nw], interpolation=cv2.INTER_LINEAR)
+    return dst, gain, (left, top)
+
+
+class InputBuffer:
+    """
+    Letterbox canvas + the float32 NCHW (RGB, 0-1) model input, allocated once: every frame
+    is written into the same two arrays, nothing per-frame is left for the garbage collector
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.canvas = np.empty((size, size, 3), np.uint8)
+        self.blob = np.empty((1, 3, size, size), np.float32)
+
+    def fill(self, img):
+        """img (BGR, any size) -> (blob, gain, pad)"""
+        lb, gain, pad = letterbox(img, self.size, self.canvas)
+        for c in range(3):  # BGR -> RGB planes, / 255
+            np.multiply(lb[..., 2 - c], 1 / 255.0, out=self.blob[0, c], casting="unsafe")
+        return self.blob, gain, pad
+
+
+def decode_segment(pred, protos, conf, size, gain, pad, orig_shape, iou=0.7, max_det=300, rects=False):
+    """
+    YOLOv8-seg raw outputs -> SegResult in original image pixels.
+    pred: (4 + nc + nm, A), protos: (nm, mh, mw)
+    rects: oriented rects from the moments of the proto-scale soft masks instead of polygons
+    """
+    nm = protos.shape[0]
+    nc = pred.shape[0] - 4 - nm
+    pred = pred.T
+    cls_scores = pred[:, 4:4 + nc]
+    classes = cls_scores.argmax(1)
+    scores = cls_scores[np.arange(len(pred)), classes]
+    keep = scores > conf
+    pred, scores, classes = pred[keep], scores[keep], classes[keep]
+    res = SegResult()
+    if len(pred) == 0:
+        res.polys = [] if nm else None
+        return res
+
+    xywh = pred[:, :4].copy()
+    xywh[:, :2] -= xywh[:, 2:] / 2  # cx, cy -> x, y
+    idx = cv2.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(), classes.tolist(), conf, iou)
+    idx = np.array(idx, int).reshape(-1)[:max_det]
+    pred, scores, classes, xywh = pred[idx], scores[idx], classes[idx], xywh[idx]
+
+    # boxes, letterbox px -> original px
+    left, top = pad
+    h0, w0 = orig_shape
+    boxes = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+    boxes_in = boxes.copy()
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - left) / gain).clip(0, w0)
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - top) / gain).clip(0, h0)
+    res.boxes = boxes.astype(np.float32)
+    res.scores = scores.astype(np.float32)
+    res.classes = classes.astype(int)
+    if nm == 0:  # detect-only model, box fallback
+        return res
+    if rects:
+        res.rects = proto_rects(pred[:, 4 + nc:], protos, boxes_in, size, gain, pad)
+        return res
+
+    # masks: logits > 0 <=> sigmoid > 0.5, only computed and traced inside their own box:
+    # the box (+1 proto px so the interpolation matches a full-size upsample) is cut from the
+    # protos first, only that crop is upsampled
+    _, mh, mw = protos.shape
+    s = size / mw  # letterbox px per proto px
+    coef = pred[:, 4 + nc:]
+    polys = []
+    for c, (x1, y1, x2, y2) in zip(coef, boxes_in):
+        x1, y1 = max(int(x1), 0), max(int(y1), 0)
+        x2, y2 = min(int(np.ceil(x2)), size), min(int(np.ceil(y2)), size)
+        if x2 <= x1 or y2 <= y1:
+            polys.append(np.empty((0, 2), np.float32))
+            continue
+        px0, py0 = max(int(x1 / s) - 1, 0), max(int(y1 / s) - 1, 0)
+        px1, py1 = min(int(np.ceil(x2 / s)) + 1, mw), min(int(np.ceil(y2 / s)) + 1, mh)
+        m = (c @ protos[:, py0:py1, px0:px1].reshape(nm, -1)).reshape(py1 - py0, px1 - px0)
+        up = cv2.resize(m, (int(round((px1 - px0) * s)), int(round((py1 - py0) * s))),
+                        interpolation=cv2.INTER_LINEAR)
+        ox, oy = int(round(px0 * s)), int(round(py0 * s))
+        binary = (up[y1 - oy:y2 - oy, x1 - ox:x2 - ox] > 0).astype(np.uint8)
+        cnts, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                   offset=(x1, y1))
+        if not cnts:
+            polys.append(np.empty((0, 2), np.float32))
+            continue
+        cnt = max(cnts, key=cv2.contourArea).reshape(-1, 2).astype(np.float32)
+        cnt[:, 0] = ((cnt[:, 0] - left) / gain).clip(0, w0)
+        cnt[:, 1] = ((cnt[:, 1] - top) / gain).clip(0, h0)
+        polys.append(cnt)
+    res.polys = polys
+    return res
+
+
+def _rescale_rects(rects, scale, gain, pad):
+    """Rects at `scale` letterbox px per mask px -> original image px (pixel centres kept)"""
+    left, top = pad
+    rects[:, 0] = ((rects[:, 0] + 0.5) * scale - 0.5 - left) / gain
+    rects[:, 1] = ((rects[:, 1] + 0.5) * scale - 0.5 - top) / gain
+    rects[:, 2:4] *= scale / gain
+    return rects
+
+
+def proto_rects(coef, protos, boxes_in, size, gain, pad) -> np.ndarray:
+    """
+    (N, 5) rects from the soft masks (sigmoid of the logits) at proto resolution, each only
+    inside its own box like the decoded masks, rescaled once to original image px
+    """
+    nm, mh, mw = protos.shape
+    s = size / mw
+    out = np.zeros((len(coef), 5), np.float32)
+    for i, (c, (x1, y1, x2, y2)) in enumerate(zip(coef, boxes_in)):
+        px0, py0 = max(int(np.floor(x1 / s)), 0), max(int(np.floor(y1 / s)), 0)
+        px1, py1 = min(int(np.ceil(x2 / s)), mw), min(int(np.ceil(y2 / s)), mh)
+        if px1 <= px0 or py1 <= py0:
+            continue
+        logits = (c @ protos[:, py0:py1, px0:px1].reshape(nm, -1)).reshape(py1 - py0, px1 - px0)
+        r = moments_rect(1 / (1 + np.exp(-logits)))
+        if r is not None:
+            out[i] = r
+            out[i, :2] += (px0, py0)
+    return _rescale_rects(out, s, gain, pad)
+
+
+def masks_data_rects(masks, boxes, orig_shape) -> np.ndarray:
+    """
+    (N, 5) rects from ultralytics masks.data (N, h, w) at the letterboxed input size, in
+    original image px; boxes: xyxy in original px, masks.xy is never touched
+    """
+    h_in, w_in = masks.shape[1:]
+    h0, w0 = orig_shape
+    gain = min(h_in / h0, w_in / w0)
+    pad = ((w_in - round(w0 * gain)) / 2, (h_in - round(h0 * gain)) / 2)
+    out = np.zeros((len(masks), 5), np.float32)
+    for i, (m, (x1, y1, x2, y2)) in enumerate(zip(masks, boxes)):
+        bx0, by0 = max(int(x1 * gain + pad[0]), 0), max(int(y1 * gain + pad[1]), 0)
+        bx1, by1 = min(int(np.ceil(x2 * gain + pad[0])) + 1, w_in), min(int(np.ceil(y2 * gain + pad[1])) + 1, h_in)
+        r = moments_rect(m[by0:by1, bx0:bx1])
+        if r is not None:
+            out[i] = r
+            out[i, :2] += (bx0, by0)
+    return _rescale_rects(out, 1.0, gain, pad)
+
+
+class TorchBackend:
+    """ultralytics YOLO on the .pt, what the station always used"""
+
+    def __init__(self, model_path, cfg=ldr.usr_cfg["cam_pos"]):
+        import torch
+        from ultralytics import YOLO
+        if DEBUG: print("Cuda available: ", torch.cuda.is_available())
+        self.model = YOLO(model_path)
+        self.rects = cfg["mask_moments"]
+
+    def predict(self, img, conf, imgsz=None) -> SegResult:
+        kw = {"imgsz": imgsz} if imgsz else {}
+        result = self.model.predict(img, conf=conf, verbose=False, **kw)[0]
+        if self.rects and result.masks is not None:  # low-res masks, no polygon tracing
+            boxes = result.boxes.xyxy.cpu().numpy()
+            return SegResult(
+                boxes=boxes,
+                scores=result.boxes.conf.cpu().numpy(),
+                classes=result.boxes.cls.cpu().numpy().astype(int),
+                names=result.names,
+                rects=masks_data_rects(result.masks.data.cpu().numpy(), boxes, img.shape[:2]))
+        return SegResult(
+            polys=None if result.masks is None else list(result.masks.xy),
+            boxes=result.boxes.xyxy.cpu().numpy(),
+            scores=result.boxes.conf.cpu().numpy(),
+            classes=result.boxes.cls.cpu().numpy().astype(int),
+            names=result.names)
+
+
+class OnnxBackend:
+    """onnxruntime on CPU with our own letterbox and YOLOv8-seg decoding, no torch import"""
+
+    def __init__(self, model_path, cfg=ldr.usr_cfg["cam_pos"]):
+        import onnxruntime as ort
+        from engine.threads import onnx_threads
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = onnx_threads()  # 0 = onnxruntime default
+        self.session = ort.InferenceSession(str(model_path), opts, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.size = int(inp.shape[2])  # fixed size export, imgsz arg of predict() is ignored
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta["names"]) if "names" in meta else {}
+        self.input = InputBuffer(self.size)
+        self.rects = cfg["mask_moments"]
+        if DEBUG: print(f"ONNX model {Path(model_path).name} loaded, input {self.size}px")
+
+    def predict(self, img, conf, imgsz=None) -> SegResult:
+        blob, gain, pad = self.input.fill(img)
+        outputs = self.session.run(self.output_names, {self.input_name: blob})
+        pred = outputs[0][0]
+        if len(outputs) > 1:  # segmentation model
+            protos = outputs[1][0]
+        else:
+            protos = np.empty((0, 1, 1), np.float32)
+        res = decode_segment(pred, protos, conf, self.size, gain, pad, img.shape[:2], rects=self.rects)
+        res.names = self.names
+        return res
+
+
+class LeanBackend:
+    """
+    The .pt without the ultralytics predictor: the TorchScript export (fused, eval mode, made
+    once by export_model) frozen for inference and fed from one preallocated input tensor.
+    Letterbox, NMS and mask decoding are the ones of OnnxBackend (masks only for the boxes
+    left after conf + NMS), no Results objects. Fixed input size like the ONNX export.
+    """
+
+    def __init__(self, model_path, cfg=ldr.usr_cfg["cam_pos"]):
+        import json
+        import torch
+        self.torch = torch
+        self.size = onnx_imgsz(cfg)
+        path = model_path if model_path.suffix == ".torchscript" else export_model(model_path, self.size, "torchscript")
+        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        extra = {"config.txt": ""}  # ultralytics export metadata (names, imgsz)
+        model = torch.jit.load(str(path), map_location=self.device, _extra_files=extra).eval()
+        try:
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+        except Exception as e:  # older torch / unsupported graph: plain eval graph
+            if DEBUG: print("TorchScript freeze skipped:", e)
+        self.model = model
+        meta = json.loads(extra["config.txt"]) if extra["config.txt"] else {}
+        self.names = {int(k): v for k, v in meta.get("names", {}).items()}
+        self.input = InputBuffer(self.size)
+        self.rects = cfg["mask_moments"]
+        self._host = torch.from_numpy(self.input.blob)  # shares memory with the numpy blob
+        self._dev = self._host if self.device.type == "cpu" else self._host.to(self.device)
+        if DEBUG: print(f"Lean model {Path(path).name} on {self.device}, input {self.size}px")
+
+    def predict(self, img, conf, imgsz=None) -> SegResult:
+        _, gain, pad = self.input.fill(img)
+        with self.torch.inference_mode():
+            if self._dev is not self._host:
+                self._dev.copy_(self._host, non_blocking=True)
+            out = self.model(self._dev)
+            if isinstance(out, (list, tuple)):  # segmentation: (pred, protos)
+                pred, protos = out[0][0].cpu().numpy(), out[1][0].cpu().numpy()
+            else:
+                pred, protos = out[0].cpu().numpy(), np.empty((0, 1, 1), np.float32)
+        res = decode_segment(pred, protos, conf, self.size, gain, pad, img.shape[:2], rects=self.rects)
+        res.names = self.names
+        return res
+
+
+def onnx_imgsz(cfg=ldr.usr_cfg["cam_pos"]) -> int:
+    # the exported graph has a fixed input, use the size most frames run at
+    return cfg["roi_imgsz"] if cfg["roi_crop"] else 640
+
+
+def load_backend(cfg=ldr.usr_cfg["cam_pos"]):
+    model_path = ldr.detect_model / cfg["detect_model"]
+    if model_path.suffix == ".onnx":
+        return OnnxBackend(model_path, cfg)
+    if cfg["backend"] == "onnx":
+        return OnnxBackend(export_onnx(model_path, onnx_imgsz(cfg)), cfg)
+    if cfg["backend"] == "lean" or model_path.suffix == ".torchscript":
+        return LeanBackend(model_path, cfg)
+    return TorchBackend(model_path, cfg)
+
+
+# ------------------------------------------------------------------
+#  Preloading: one model per process, loaded + warmed in the background
+# ------------------------------------------------------------------
+def warm_up(model, cfg=ldr.usr_cfg["cam_pos"], runs=WARMUP_RUNS):
+    """A few dummy predictions at the size update() will use, pays graph building / allocator warm-up"""
+    size = onnx_imgsz(cfg)
+    dummy = np.full((size, size, 3), 114, np.uint8)
+    kw = {"imgsz": size} if cfg["roi_crop"] else {}
+    for _ in range(runs):
+        model.predict(dummy, cfg["conf"], **kw)
+
+
+def _model_key(cfg):
+    """Everything the backends read at load time, a change loads a new model"""
+    return cfg["detect_model"], cfg["backend"], cfg["roi_crop"], cfg["roi_imgsz"], bool(cfg["mask_moments"])
+
+
+class ModelPreloader(threading.Thread):
+    """load_backend + warm_up on a daemon thread, started during the splash screen"""
+
+    def __init__(self, cfg=ldr.usr_cfg["cam_pos"]):
+        super().__init__(name="ModelPreloader", daemon=True)
+        self.cfg = dict(cfg)
+        self.key = _model_key(cfg)
+        self.model = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        from engine.threads import apply_thread_budget
+        # torch creates its pools on the first load / predict, here: the detect budget has to be set first
+        apply_thread_budget("detect", process_wide=False)
+        t = time.perf_counter()
+        try:
+            self.model = load_backend(self.cfg)
+            warm_up(self.model, self.cfg)
+            if DEBUG: print(f"Detection model ready in {time.perf_counter() - t:.1f}s")
+        except Exception as e:  # BatteryLocator loads it again and shows the real error
+            self.error = e
+            print(f"Model preload failed: {e}")
+        finally:
+            self.done.set()
+
+
+_preloader = None
+_lock = threading.Lock()
+
+
+def preload(cfg=ldr.usr_cfg["cam_pos"]):
+    """Start loading the detection model in the background (no-op if already loading / loaded)"""
+    global _preloader
+    with _lock:
+        if _preloader is None or _preloader.key != _model_key(cfg):
+            _preloader = ModelPreloader(cfg)
+            _preloader.start()
+    return _preloader
+
+
+def shared_model(cfg=ldr.usr_cfg["cam_pos"]):
+    """
+    The preloaded model (waits for it if still loading), so BatteryLocator and camera restarts
+    don't load and warm it again. Loads it here if nothing was preloaded or the config changed.
+    """
+    loader = preload(cfg)
+    loader.done.wait()
+    if loader.model is None:
+        model = load_backend(cfg)
+        warm_up(model, cfg)
+        loader.model, loader.error = model, None
+    return loader.model
@@ -36,12 +36,15 @@ for path in [factory_cfg_path, cfg_path, usr_cfg_path, markdown_path]:
 
 detect_model = PROJECT_ROOT / "camera" / "model"
 camera_calib = PROJECT_ROOT / "camera" / "calib"
+aruco_dir = PROJECT_ROOT / "aruco"
 batt_matrix_path = PROJECT_ROOT / "matrix"
 
 def reload_cfg(parent=None):
     global usr_cfg, cfg, camera_calib_files, detect_model_files, batt_matrix_files
-    camera_calib_files = [f for f in os.listdir(camera_calib) if os.path.isfile(os.path.join(camera_calib, f))]
-    detect_model_files = [f for f in os.listdir(detect_model) if os.path.isfile(os.path.join(detect_model, f))]
+    camera_calib_files = [f for f in os.listdir(camera_calib) if os.path.isfile(os.path.join(camera_calib, f))
+                          and not f.endswith(".homography.npz")]  # cached H, saved by engine.homography
+    detect_model_files = [f for f in os.listdir(detect_model) if os.path.isfile(os.path.join(detect_model, f))
+                          and ".export." not in f]  # cached ONNX / TorchScript exports, made by engine.inference
     batt_matrix_files = [f for f in os.listdir(batt_matrix_path) if os.path.isfile(os.path.join(batt_matrix_path, f))]
 
     usr_cfg = None
@@ -259,18 +262,77 @@ value_constraints = {
     "tag_size": lambda v: is_number(v) and v >= 0,
     "tray_width": lambda v: is_number(v) and v >= 0,
     "tray_length": lambda v: is_number(v) and v >= 0,
+    "roi_imgsz": lambda v: isinstance(v, int) and v > 0 and v % 32 == 0,
+    "h_resolve_s": lambda v: is_number(v) and v >= 0,
+    "h_drift_px": lambda v: is_number(v) and v >= 0,
+    "preview_fps": lambda v: is_number(v) and v >= 0,
+    "track_gate_mm": lambda v: is_number(v) and v > 0,
+    "track_meas_mm": lambda v: is_number(v) and v > 0,
+    "track_conv_mm": lambda v: is_number(v) and v > 0,
+    "motion_scale": lambda v: is_number(v) and 0 < v <= 1,
+    "tray_view_px_mm": lambda v: is_number(v) and v > 0,
+    "motion_thresh": lambda v: is_number(v) and 0 <= v <= 255,
+    "motion_frac": lambda v: is_number(v) and 0 <= v <= 1,
+    "motion_max_stale_s": lambda v: is_number(v) and v >= 0,
+    "refine_crop_mm": lambda v: is_number(v) and v > 0,
+    "pick_w_dist": lambda v: is_number(v) and v >= 0,
+    "pick_w_angle": lambda v: is_number(v) and v >= 0,
+    "pick_w_conf": lambda v: is_number(v) and v >= 0,
+    "refine_max_mm": lambda v: is_number(v) and v > 0,
 
     # Bool (0/1 or bool)
     "show_masks": lambda v: isinstance(v, (bool, int)),
+    "roi_crop": lambda v: isinstance(v, (bool, int)),
+    "h_cache": lambda v: isinstance(v, (bool, int)),
+    "mask_close": lambda v: isinstance(v, (bool, int)),
+    "mask_moments": lambda v: isinstance(v, (bool, int)),
+    "headless": lambda v: isinstance(v, (bool, int)),
+    "backend": lambda v: v in ("torch", "onnx", "lean"),
+    "source": lambda v: v in ("auto", "v4l2", "dshow", "msmf", "file", "synthetic"),
+    "source_path": lambda v: isinstance(v, str),
+    "fourcc": lambda v: isinstance(v, str) and len(v) in (0, 4),
+    "fps": lambda v: is_number(v) and v >= 0,
+    "grab_thread": lambda v: isinstance(v, (bool, int)),
+    "detect_process": lambda v: isinstance(v, (bool, int)),
+    "pipeline": lambda v: isinstance(v, (bool, int)),
+    "tracker": lambda v: isinstance(v, (bool, int)),
+    "motion_gate": lambda v: isinstance(v, (bool, int)),
+    "profile": lambda v: isinstance(v, (bool, int)),
+    "tray_view": lambda v: isinstance(v, (bool, int)),
+    "undistort_points": lambda v: isinstance(v, (bool, int)),
+    "refine": lambda v: isinstance(v, (bool, int)),
     "debug": lambda v: isinstance(v, (bool, int)),
 
     # Int only
     "guard_px": lambda v: isinstance(v, int) and v >= 0,
     "frame_to_avg": lambda v: isinstance(v, int) and v >= 0,
+    "roi_margin_px": lambda v: isinstance(v, int) and v >= 0,
+    "track_max_miss": lambda v: isinstance(v, int) and v >= 0,
+    "motion_settle_frames": lambda v: isinstance(v, int) and v >= 0,
+    "width": lambda v: isinstance(v, int) and v >= 0,
+    "height": lambda v: isinstance(v, int) and v >= 0,
+    "buffer_size": lambda v: isinstance(v, int) and v >= 0,
+    "refine_width": lambda v: isinstance(v, int) and v >= 0,
+    "refine_height": lambda v: isinstance(v, int) and v >= 0,
+    "cv2": lambda v: isinstance(v, int) and v >= 0,
+    "torch": lambda v: isinstance(v, int) and v >= 0,
+    "interop": lambda v: isinstance(v, int) and v >= 0,
+    "onnx": lambda v: isinstance(v, int) and v >= 0,
+    "h_check_frames": lambda v: isinstance(v, int) and v > 0,
+    "pipeline_depth": lambda v: isinstance(v, int) and v > 0,
 
     # List of ints
     "tag_ids": lambda v: isinstance(v, list) and all(isinstance(i, int) and i >= 0 for i in v),
 
+    "cores": lambda v: isinstance(v, list) and all(isinstance(i, int) and 0 <= i < (os.cpu_count() or 1) for i in v),
+
+    # [x, y] in mm
+    "pick_ref_mm": lambda v: isinstance(v, list) and len(v) == 2 and all(is_number(x) for x in v),
+
+    # List of [x0, y0, x1, y1] rects
+    "motion_ignore_mm": lambda v: isinstance(v, list) and all(
+        isinstance(r, list) and len(r) == 4 and all(is_number(x) for x in r) for r in v),
+
     # Lists of 6 numbers
     "arm_default_pos": is_list_of_6_numbers,
     "tcp_default_pos": is_list_of_6_numbers,
@@ -281,10 +343,14 @@ value_constraints = {
 
     # File checks
     "camera_calib": lambda v: file_exists(camera_calib, v),
+    "refine_calib": lambda v: file_exists(camera_calib, v),
     "detect_model": lambda v: file_exists(detect_model, v),
     "batt_matrix": lambda v: file_exists(PROJECT_ROOT / "matrix", v),
 }
 
+# keys where "" means "not used / driver default"
+empty_allowed = {"source_path", "fourcc"}
+
 
 def validate_yaml(data: str, reference_data=None, parent=None) -> bool:
     def apply_constraints(path, key, val):
@@ -293,7 +359,7 @@ def validate_yaml(data: str, reference_data=None, parent=None) -> bool:
 
         try:
             # Check for empty/null values
-            if val is None or (isinstance(val, str) and not val.strip()):
+            if val is None or (isinstance(val, str) and not val.strip() and key not in empty_allowed):
                 errors.append(f"{path} → ❌ Missing or empty value")
                 return
 
@@ -303,7 +369,7 @@ def validate_yaml(data: str, reference_data=None, parent=None) -> bool:
                 return
 
             if rule and not rule(val):
-                if key in {"camera_calib", "detect_model", "batt_matrix"}:
+                if key in {"camera_calib", "refine_calib", "detect_model", "batt_matrix"}:
                     errors.append(f"{path} → ❌ File does not exist: {val}")
                 elif key in {"arm_default_pos", "tcp_default_pos", "tcp_end_pos",
                              "tcp_transfer_pos", "tcp_offset", "user_coord"}:
@@ -316,12 +382,30 @@ def validate_yaml(data: str, reference_data=None, parent=None) -> bool:
                         errors.append(f"{path} → ❌ Expected a list of ints, got: {type(val).__name__}")
                     else:
                         errors.append(f"{path} → ❌ List must contain only non-negative ints, got: {val}")
-                elif key in {"show_masks", "debug"}:
+                elif key in {"show_masks", "debug", "roi_crop", "h_cache", "mask_close", "mask_moments", "headless", "grab_thread", "detect_process", "pipeline", "tracker", "motion_gate", "profile", "tray_view", "undistort_points", "refine"}:
                     errors.append(f"{path} → ❌ Expected bool (or 0/1), got: {val} ({type(val).__name__})")
-                elif key in {"guard_px", "frame_to_avg"}:
+                elif key in {"guard_px", "frame_to_avg", "roi_margin_px", "track_max_miss", "motion_settle_frames",
+                             "cv2", "torch", "interop", "onnx", "width", "height", "buffer_size",
+                             "refine_width", "refine_height"}:
                     errors.append(f"{path} → ❌ Expected non-negative int, got: {val} ({type(val).__name__})")
+                elif key in {"h_check_frames", "pipeline_depth"}:
+                    errors.append(f"{path} → ❌ Expected positive int, got: {val} ({type(val).__name__})")
                 elif key == "conf":
                     errors.append(f"{path} → ❌ Expected number between 0 and 1, got: {val}")
+                elif key == "backend":
+                    errors.append(f"{path} → ❌ Expected 'torch', 'onnx' or 'lean', got: {val}")
+                elif key == "source":
+                    errors.append(f"{path} → ❌ Expected auto, v4l2, dshow, msmf, file or synthetic, got: {val}")
+                elif key == "fourcc":
+                    errors.append(f"{path} → ❌ Expected a 4 character code (MJPG, YUYV) or \"\", got: {val}")
+                elif key == "cores":
+                    errors.append(f"{path} → ❌ Expected a list of CPU ids (0-{(os.cpu_count() or 1) - 1}), got: {val}")
+                elif key == "pick_ref_mm":
+                    errors.append(f"{path} → ❌ Expected [x, y] in mm, got: {val}")
+                elif key == "motion_ignore_mm":
+                    errors.append(f"{path} → ❌ Expected a list of [x0, y0, x1, y1] rects in mm, got: {val}")
+                elif key == "roi_imgsz":
+                    errors.append(f"{path} → ❌ Expected positive int multiple of 32, got: {val}")
                 else:
                     errors.append(f"{path} → ❌ Invalid value: {val} ({type(val).__name__})")
         except Exception as e:
@@ -0,0 +1,109 @@
+import time
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.homography import same_h, tray_roi
+
+
+class MotionGate:
+    """
+    Decides if the model has to run on a frame. The tray crop is shrunk by motion_scale,
+    turned gray and compared to the crop of the last frame the model ran on; the
+    motion_ignore_mm rects (where the arm covers the tray) are masked out. The model runs on
+    change, for motion_settle_frames frames after it (so the tracker gets fresh samples), and
+    at least every motion_max_stale_s.
+    """
+
+    def __init__(self, frame_size, cfg=ldr.usr_cfg["cam_pos"], lens=None):
+        self.cfg = cfg
+        self.lens = lens  # PointLens when the frames are raw (undistort_points)
+        self.frame_size = frame_size
+        self.scale = cfg["motion_scale"]
+        self.thresh = cfg["motion_thresh"]
+        self.frac = cfg["motion_frac"]
+        self.max_stale = cfg["motion_max_stale_s"]
+        self.settle = cfg["motion_settle_frames"]
+
+        self.ref = None  # small gray crop of the last frame the model ran on
+        self.small = None  # small gray crop of the current frame
+        self.valid = None  # 255 where changes count
+        self._key = None  # (roi, H) the mask was built for
+        self._settle_left = 0
+        self.last_run = 0.0
+        self.changed_frac = 0.0
+
+        # stats for the debug overlay
+        self.frames = 0
+        self.skipped = 0
+        self.run_cost = 0.0  # EMA of predict + post-process time, s
+        self._t0 = time.monotonic()
+
+    def _crop(self, frame, H):
+        # by value: a re-solved H within h_drift_px (h_cache off: every frame) keeps the mask and the reference
+        if self._key is None or not same_h(H, self._key[1], self.cfg):
+            roi = tray_roi(H, self.frame_size, self.cfg, self.lens)
+            if roi is None:
+                w, h = self.frame_size
+                roi = (0, 0, w, h)
+            self._build_mask(roi, H)
+        x0, y0, x1, y1 = self._key[0]
+        small = cv2.resize(frame[y0:y1, x0:x1], self.valid.shape[::-1], interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _build_mask(self, roi, H):
+        x0, y0, x1, y1 = roi
+        size = (max(int((x1 - x0) * self.scale), 1), max(int((y1 - y0) * self.scale), 1))
+        self.valid = np.full(size[::-1], 255, np.uint8)
+        if H is not None and self.cfg["motion_ignore_mm"]:
+            Hinv = np.linalg.inv(H)
+            for mx0, my0, mx1, my1 in self.cfg["motion_ignore_mm"]:
+                rect = np.array([[mx0, my0], [mx1, my0], [mx1, my1], [mx0, my1]], np.float32)
+                px = cv2.perspectiveTransform(rect[None], Hinv)[0]
+                if self.lens is not None:
+                    px = self.lens.distort(px)
+                px = (px - [x0, y0]) * self.scale
+                cv2.fillPoly(self.valid, [px.round().astype(np.int32)], 0)
+        self._key = (roi, H)
+        self.ref = None  # crop geometry changed, the old reference is useless
+
+    def changed(self, frame, H) -> bool:
+        """True when the model should run on this frame"""
+        self.frames += 1
+        self.small = self._crop(frame, H)
+        if self.ref is None or time.monotonic() - self.last_run >= self.max_stale:
+            return True
+        diff = cv2.absdiff(self.small, self.ref)
+        _, moved = cv2.threshold(diff, self.thresh, 255, cv2.THRESH_BINARY)
+        moved = cv2.bitwise_and(moved, self.valid)
+        self.changed_frac = cv2.countNonZero(moved) / moved.size
+        if self.changed_frac > self.frac:
+            self._settle_left = self.settle
+            return True
+        if self._settle_left > 0:
+            self._settle_left -= 1
+            return True
+        self.skipped += 1
+        return False
+
+    def ran(self, seconds, small=None, key=None):
+        """
+        Model ran on the current frame in `seconds`, it becomes the new reference.
+        small, key: the crop changed() made for that frame and the (roi, H) it was made for, when
+        newer frames were checked since (pipeline). Dropped when the mask was rebuilt in between.
+        """
+        if small is None:
+            self.ref = self.small
+        elif small.shape == self.valid.shape and (key is None or key is self._key):
+            self.ref = small
+        self.last_run = time.monotonic()
+        self.run_cost = seconds if self.run_cost == 0.0 else 0.9 * self.run_cost + 0.1 * seconds
+
+    def info(self) -> str:
+        """Skip ratio and model time saved per second of wall time"""
+        if self.frames == 0:
+            return ""
+        elapsed = max(time.monotonic() - self._t0, 1e-6)
+        saved = self.skipped * self.run_cost / elapsed
+        return f"skip: {100 * self.skipped / self.frames:.0f}% saved: {saved * 1e3:.0f}ms/s"
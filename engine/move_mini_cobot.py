@@ -64,6 +64,9 @@ class Arm:
     def update_status(self):
         self.status = self.robot.get_robot_status()
         self.arm_status.update({"connected": self.status[0] == 0, "powered": self.status[1][2], "enabled": self.status[1][3]})
+        tcp = self.robot.get_tcp_position()  # user frame (table_corner), what the pick ranking measures from
+        if tcp[0] == 0:
+            self.arm_status["tcp"] = list(tcp[1])
         
     def update_var(self):
         ldr.reload_cfg()
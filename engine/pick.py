@@ -0,0 +1,49 @@
+import numpy as np
+
+import engine.loader as ldr
+
+PICK_FIELDS = ("x_mm", "y_mm", "theta", "cls")  # what arm 1 gets (batt_coords)
+
+
+def in_zone(det, zone=ldr.cfg["mini"]) -> np.ndarray:
+    """Bool mask of the rows inside the arm 1 pick zone (mini min_x < x < max_x, same for y)"""
+    return ((det["x_mm"] > zone["min_x"]) & (det["x_mm"] < zone["max_x"])
+            & (det["y_mm"] > zone["min_y"]) & (det["y_mm"] < zone["max_y"]))
+
+
+def wrist_turn(theta) -> np.ndarray:
+    """Degrees the wrist turns for a battery at theta, as in Arm.take_object (-theta, or 90 - theta past 90)"""
+    theta = np.asarray(theta, np.float64)
+    return np.where(theta < 90, theta, theta - 90)
+
+
+def as_coords(row) -> np.ndarray:
+    """(x, y, theta, cls) of a detection / track row"""
+    return np.array([row[f] for f in PICK_FIELDS], float)
+
+
+class PickRanker:
+    """
+    Orders the batteries arm 1 may pick. The zone test runs on all rows at once, the rows
+    inside are sorted by
+        pick_w_dist * mm from arm 1 + pick_w_angle * wrist turn + pick_w_conf * (1 - conf)
+    so a battery out of reach never hides the ones that are not, and the rest of the queue
+    is ready when the head is gone. Arm 1 is at pick_ref_mm until a position is given.
+    """
+
+    def __init__(self, cfg=ldr.usr_cfg["main"], zone=ldr.cfg["mini"]):
+        self.cfg = cfg
+        self.zone = zone
+        self.ref = tuple(cfg["pick_ref_mm"])
+
+    def cost(self, det, ref=None) -> np.ndarray:
+        x0, y0 = self.ref if ref is None else ref
+        cfg = self.cfg
+        return (cfg["pick_w_dist"] * np.hypot(det["x_mm"] - x0, det["y_mm"] - y0)
+                + cfg["pick_w_angle"] * wrist_turn(det["theta"])
+                + cfg["pick_w_conf"] * (1 - det["conf"]))
+
+    def rank(self, det, ref=None) -> np.ndarray:
+        """Indexes of the rows inside the zone, cheapest first"""
+        inside = np.flatnonzero(in_zone(det, self.zone))
+        return inside[np.argsort(self.cost(det[inside], ref), kind="stable")]
@@ -0,0 +1,222 @@
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import engine.loader as ldr
+from engine.geometry import empty_detections
+
+DEBUG = ldr.usr_cfg["main"]["debug"]
+
+
+@dataclass
+class FrameJob:
+    """One frame on its way through the stages"""
+    seq: int
+    ts: float  # time.monotonic() it was grabbed at
+    ok: bool = True
+    frame: np.ndarray = None  # undistorted / tray view / raw (undistort_points) frame
+    H: np.ndarray = None
+    run: bool = False  # the model runs on it (motion gate)
+    small: np.ndarray = None  # motion gate crop, the reference once the model ran
+    gate_key: tuple = None  # (roi, H) the crop was made for
+    t_run: float = 0.0  # perf_counter() when predict started
+    pred: tuple = None  # polys, boxes, classes, names, mask rects, scores
+    det: np.ndarray = field(default_factory=empty_detections)
+    rects: list = None
+    boxes: np.ndarray = None
+    crops: list = None  # copied post.crops, the post stage reuses its buffers for the next frame
+
+
+class Stage(threading.Thread):
+    """Takes a job from `inq`, runs `work` on it and passes it on to `outq` (blocking, bounded)"""
+
+    def __init__(self, name, work, inq, outq, pipeline):
+        super().__init__(name=f"CamPos-{name}", daemon=True)
+        self.stage = name
+        self.work = work
+        self.inq = inq
+        self.outq = outq
+        self.pipeline = pipeline
+        self.busy = 0.0  # EMA of the work time per job, s
+
+    def _put(self, job):
+        while self.pipeline.running:
+            try:
+                self.outq.put(job, timeout=0.1)
+                return
+            except queue.Full:  # downstream is slower, wait for it (back-pressure)
+                continue
+
+    def run(self):
+        while self.pipeline.running:
+            if self.inq is None:
+                job = None  # source stage, work() makes the job
+            else:
+                try:
+                    job = self.inq.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            t = time.perf_counter()
+            try:
+                job = self.work(job)
+            except Exception as e:  # a dead stage would stall update() forever
+                self.pipeline.fail(self.stage, e)
+                return
+            dt = time.perf_counter() - t
+            self.busy = dt if self.busy == 0.0 else 0.9 * self.busy + 0.1 * dt
+            if job is not None:
+                self._put(job)
+
+
+class DetectionPipeline:
+    """
+    BatteryLocator.update() split over threads, connected by queues of pipeline_depth jobs:
+        prep:  grab (FrameGrabber) -> remap / tray view -> homography -> motion gate
+        infer: model predict on the tray crop
+        post:  masks -> rects -> mm
+    and update() on the caller's thread takes the finished frames in order and sets the same
+    attributes as BatteryLocator.update() (last_detections, fresh, ...), so render(), the
+    tracker and the pick logic don't change. Frame N+1 is prepared while frame N is in the
+    model: the frame rate goes from 1 / sum(stage times) towards 1 / max(stage time), the
+    latency of one frame stays about the same. A full queue blocks the stage before it; the
+    grabber keeps dropping the old camera frames, so the model always gets a recent one.
+    """
+
+    STAGES = ("prep", "infer", "post")
+
+    def __init__(self, bl, cfg=None):
+        self.bl = bl
+        self.cfg = bl.cfg if cfg is None else cfg  # the locator's, read when it was made
+        self.depth = cfg["pipeline_depth"]
+        self.running = False
+        self.error = None  # (stage, exception) that stopped the pipeline
+        self.queues = {name: queue.Queue(maxsize=self.depth) for name in self.STAGES}  # stage -> its output
+        self.peak = dict.fromkeys(self.STAGES, 0)  # max queue depth seen
+        self.in_flight = 0  # jobs read from the camera and not yet taken by update()
+        self._lock = threading.Lock()
+        self.threads = []
+        # profiling: every stage marks on its own thread (StageTimer keeps the clock per thread)
+        self.timer = bl.timer
+        bl.pipeline = self
+
+    # ------------------------------------------------------------------
+    #  Stages
+    # ------------------------------------------------------------------
+    def _prep(self, _):
+        bl, timer = self.bl, self.timer
+        if not bl.cap.isOpened():
+            time.sleep(0.01)
+            return None
+        timer.begin()
+        ok, raw, seq, ts = bl._read()
+        timer.mark("read")
+        job = FrameJob(seq, ts, ok)
+        with self._lock:
+            self.in_flight += 1
+        if not ok:
+            return job
+        job.frame, job.H = bl._prepare(raw, timer)
+        if job.frame is not None:
+            job.run = True
+            if bl.gate is not None:
+                job.run = bl.gate.changed(job.frame, job.H)
+                job.small = bl.gate.small
+                job.gate_key = bl.gate._key
+                timer.mark("gate")
+        return job
+
+    def _infer(self, job):
+        if job.run:
+            self.timer.begin()
+            job.t_run = time.perf_counter()
+            job.pred = self.bl._predict(job.frame, self.cfg, job.H)
+            self.timer.mark("predict")
+        return job
+
+    def _post(self, job):
+        if job.run:
+            bl = self.bl
+            self.timer.begin()
+            polys, boxes, classes, _, mask_rects, scores = job.pred
+            job.det, job.rects, job.boxes = bl._postprocess(polys, boxes, classes, job.H, self.cfg, mask_rects,
+                                                            scores)
+            if job.rects is not None and self.cfg["show_masks"]:
+                job.crops = [(x, y, m.copy()) for x, y, m in bl.post.crops]
+            self.timer.mark("post")
+            if bl.gate is not None:
+                bl.gate.ran(time.perf_counter() - job.t_run, job.small, job.gate_key)
+        return job
+
+    # ------------------------------------------------------------------
+    def start(self):
+        self.running = True
+        inq = None
+        for name in self.STAGES:
+            outq = self.queues[name]
+            stage = Stage(name, getattr(self, f"_{name}"), inq, outq, self)
+            stage.start()
+            self.threads.append(stage)
+            inq = outq
+        if DEBUG: print(f"Detection pipeline started, queue depth {self.depth}")
+        return self
+
+    def fail(self, stage, e):
+        """A stage raised: log it and stop all stages, the owner sees `error` and starts a new pipeline"""
+        print(f"Detection pipeline: {stage} stage failed: {e!r}")
+        traceback.print_exc()
+        self.error = (stage, e)
+        self.running = False
+
+    def update(self, timeout=1.0):
+        """Next finished frame, same contract as BatteryLocator.update()"""
+        bl = self.bl
+        self._sample_depths()
+        try:
+            job = self.queues["post"].get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self.in_flight -= 1
+        bl.frame_seq, bl.frame_ts = job.seq, job.ts
+        bl._tick_fps()
+        if not job.ok or job.frame is None:
+            bl.last_detections = empty_detections()
+            return None
+        bl.H = job.H
+        bl._last_frame = job.frame
+        if job.run:
+            bl.last_detections, bl.last_rects, bl.last_boxes = job.det, job.rects, job.boxes
+            bl.last_crops = job.crops or []
+            bl.names = job.pred[3]
+        bl.fresh = job.run
+        bl.frame_age = time.monotonic() - job.ts
+        return job.frame
+
+    def pending(self) -> bool:
+        """Frames still in the stages, e.g. to drain them after the end of a recording"""
+        return self.in_flight > 0
+
+    def _sample_depths(self):
+        for name, q in self.queues.items():
+            self.peak[name] = max(self.peak[name], q.qsize())
+
+    def depths(self) -> dict:
+        """stage -> (jobs waiting in its output queue, peak, work time per job in ms)"""
+        return {t.stage: (self.queues[t.stage].qsize(), self.peak[t.stage], t.busy * 1e3)
+                for t in self.threads}
+
+    def info(self) -> str:
+        """Queue depth / peak and work time per stage, for the debug overlay"""
+        return " ".join(f"{name}:{n}/{peak} {ms:.0f}ms" for name, (n, peak, ms) in self.depths().items())
+
+    def stop(self):
+        self.running = False
+        for t in self.threads:
+            if t.is_alive() and threading.current_thread() is not t:
+                t.join(timeout=1.0)
+        self.threads.clear()
+        self.bl.pipeline = None
@@ -0,0 +1,128 @@
+import cv2
+import numpy as np
+
+
+def moments_rect(mask):
+    """
+    Oriented rect (cx, cy, long, short, angle deg) of a battery mask from its image moments:
+    centroid + principal axes, a uniform rectangle of side L has variance L^2 / 12 along it.
+    mask: binary or soft (0-1 weights) array at any scale, pixel centres at integer coords.
+    None when the mask is empty.
+    """
+    m = cv2.moments(mask.astype(np.float32, copy=False))
+    if m["m00"] <= 1e-6:
+        return None
+    cx, cy = m["m10"] / m["m00"], m["m01"] / m["m00"]
+    a, b, c = m["mu20"] / m["m00"], m["mu11"] / m["m00"], m["mu02"] / m["m00"]
+    d = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    l1, l2 = (a + c) / 2 + d, max((a + c) / 2 - d, 0.0)
+    angle = np.degrees(0.5 * np.arctan2(2 * b, a - c))
+    return cx, cy, np.sqrt(12 * l1), np.sqrt(12 * l2), angle
+
+
+def rect_corners(rects: np.ndarray) -> np.ndarray:
+    """Vectorised cv2.boxPoints for (N, 5) cx, cy, w, h, angle -> (N, 4, 2)"""
+    cx, cy, w, h, ang = rects.T
+    c, s = np.cos(np.radians(ang)), np.sin(np.radians(ang))
+    dx = np.stack([c * w, s * w], axis=1)[:, None] / 2
+    dy = np.stack([-s * h, c * h], axis=1)[:, None] / 2
+    signs = np.array([[-1, 1], [-1, -1], [1, -1], [1, 1]], np.float32)[None]
+    return rects[:, None, :2] + signs[..., :1] * dx + signs[..., 1:] * dy
+
+
+class MaskPostProcessor:
+    """
+    Turns the YOLO mask polygons into oriented rects without full-frame allocations.
+    Every kept battery gets a bounding-box-local crop from a preallocated buffer pool
+    (grown only when a frame has more batteries than ever before), the closing is done
+    on that crop with a cached kernel, and the overlay of all masks is blended in one
+    pass per frame.
+    """
+
+    def __init__(self, frame_size, close=True, pool_size=8):
+        self.w_img, self.h_img = frame_size
+        self.close = close
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        self._pool = [np.empty((self.h_img, self.w_img), np.uint8) for _ in range(pool_size)]
+        self._overlay_mask = np.zeros((self.h_img, self.w_img), np.uint8)
+        self._blend = np.empty((self.h_img, self.w_img, 3), np.uint8)
+        self._color = None
+        self.crops = []  # (x, y, mask view) of the current frame, valid until next process()
+
+    def _buffer(self, i):
+        if i == len(self._pool):
+            self._pool.append(np.empty((self.h_img, self.w_img), np.uint8))
+        return self._pool[i]
+
+    def process(self, polys, guard_px=0):
+        """Returns (kept indexes, minAreaRects) for the polygons that are not cut by the frame border"""
+        kept, rects = [], []
+        self.crops.clear()
+        lo = guard_px
+        hi = np.array([self.w_img - guard_px, self.h_img - guard_px])
+        for idx, cnt in enumerate(polys):
+            if len(cnt) < 3 or (cnt < lo).any() or (cnt > hi).any():
+                continue
+            # 2px pad so the dilate of the closing never reaches the crop border
+            x, y, w, h = cv2.boundingRect(cnt)
+            x, y = max(x - 2, 0), max(y - 2, 0)
+            w, h = min(w + 4, self.w_img - x), min(h + 4, self.h_img - y)
+            mask = self._buffer(len(self.crops))[:h, :w]
+            mask.fill(0)
+            cv2.fillPoly(mask, [cnt], 255, offset=(-x, -y))
+            self.crops.append((x, y, mask))
+
+            if self.close:
+                cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel, dst=mask)
+                cnt2, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                           offset=(x, y))
+                if not cnt2:
+                    self.crops.pop()
+                    continue
+                rect = cv2.minAreaRect(max(cnt2, key=cv2.contourArea))
+            else:
+                rect = cv2.minAreaRect(cnt)
+            kept.append(idx)
+            rects.append(rect)
+        return kept, rects
+
+    def process_rects(self, rects, guard_px=0):
+        """
+        Rects measured on the low-res masks (mask_moments): (kept indexes, rect tuples) of the
+        ones not cut by the frame border. No mask crops, the overlay draws only the rects.
+        """
+        self.crops.clear()
+        if len(rects) == 0:
+            return [], []
+        corners = rect_corners(rects)
+        hi = np.array([self.w_img - guard_px, self.h_img - guard_px])
+        inside = ((corners >= guard_px) & (corners <= hi)).all(axis=(1, 2))
+        kept = np.flatnonzero(inside).tolist()
+        return kept, [((r[0], r[1]), (r[2], r[3]), r[4]) for r in rects[kept]]
+
+    def blend(self, frame, color=(0, 0, 200), alpha=0.35, crops=None):
+        """
+        Tints every mask of the last process() call onto frame, in place, with one blend.
+        crops: (x, y, mask) list kept from an earlier process() call instead (pipeline mode).
+        """
+        crops = self.crops if crops is None else crops
+        if not crops:
+            return frame
+        if self._color is None or self._color[0, 0].tolist() != list(color):
+            self._color = np.empty_like(self._blend)
+            self._color[:] = color
+        # union of the crops, only this region is blended
+        x0 = min(x for x, _, _ in crops)
+        y0 = min(y for _, y, _ in crops)
+        x1 = max(x + m.shape[1] for x, _, m in crops)
+        y1 = max(y + m.shape[0] for _, y, m in crops)
+        roi_mask = self._overlay_mask[y0:y1, x0:x1]
+        roi_mask.fill(0)
+        for x, y, m in crops:
+            sub = roi_mask[y - y0:y - y0 + m.shape[0], x - x0:x - x0 + m.shape[1]]
+            cv2.bitwise_or(sub, m, dst=sub)
+        roi = frame[y0:y1, x0:x1]
+        blend = self._blend[y0:y1, x0:x1]
+        cv2.addWeighted(self._color[y0:y1, x0:x1], alpha, roi, 1 - alpha, 0, dst=blend)
+        cv2.copyTo(blend, roi_mask, roi)
+        return frame
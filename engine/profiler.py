@@ -0,0 +1,98 @@
+import csv
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+STAGES = ("read", "remap", "homography", "gate", "predict", "post", "draw")
+HIST_EDGES_MS = np.array([0, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, np.inf])
+
+
+class StageTimer:
+    """
+    Rolling per-stage timings of BatteryLocator with time.perf_counter_ns: begin() starts the
+    clock, mark(stage) stores the time since the previous mark into that stage's ring of the
+    last `window` samples. Histograms and percentiles are only computed when pulled.
+    The clock is per thread, so the stages of engine.pipeline can mark from their own threads
+    (every stage is only marked by one thread).
+    """
+
+    enabled = True
+
+    def __init__(self, stages=STAGES, window=1024):
+        self.stages = stages
+        self.window = window
+        self.samples = {s: np.zeros(window, np.int64) for s in stages}  # ns
+        self.count = dict.fromkeys(stages, 0)
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.t = time.perf_counter_ns()
+
+    def mark(self, stage):
+        now = time.perf_counter_ns()
+        n = self.count[stage]
+        self.samples[stage][n % self.window] = now - self._local.t
+        self.count[stage] = n + 1
+        self._local.t = now
+
+    def values_ms(self, stage) -> np.ndarray:
+        n = min(self.count[stage], self.window)
+        return self.samples[stage][:n] / 1e6
+
+    def histogram(self, stage, edges=HIST_EDGES_MS):
+        return np.histogram(self.values_ms(stage), edges)[0]
+
+    def summary(self) -> dict:
+        """stage -> {n, mean, p50, p95, p99, max} in ms, over the last `window` samples"""
+        out = {}
+        for s in self.stages:
+            v = self.values_ms(s)
+            if len(v) == 0:
+                continue
+            p50, p95, p99 = np.percentile(v, [50, 95, 99])
+            out[s] = {"n": self.count[s], "mean": v.mean(), "p50": p50, "p95": p95,
+                      "p99": p99, "max": v.max()}
+        return out
+
+    def to_csv(self, path):
+        """One row per stage: stats + histogram counts (bin upper edges in the header)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        bins = [f"le_{e:g}ms" for e in HIST_EDGES_MS[1:-1]] + [f"gt_{HIST_EDGES_MS[-2]:g}ms"]
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["stage", "n", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"] + bins)
+            for s, st in self.summary().items():
+                w.writerow([s, st["n"]] + [f"{st[k]:.3f}" for k in ("mean", "p50", "p95", "p99", "max")]
+                           + self.histogram(s).tolist())
+        return path
+
+    def reset(self):
+        for s in self.stages:
+            self.count[s] = 0
+
+
+class NullTimer:
+    """Profiling off: same interface, nothing recorded"""
+
+    enabled = False
+
+    def begin(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def summary(self) -> dict:
+        return {}
+
+    def to_csv(self, path):
+        return None
+
+    def reset(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,235 @@
+# ------------------------------------------------------------------
+#  INT8 static quantisation of the detection model + accuracy/latency report
+# ------------------------------------------------------------------
+# python -m engine.quantize_model --frames ImagesCaptured/tray [--model bestpinv5.pt] [--out bestpinv5_int8.onnx]
+#
+# 1. exports the FP32 ONNX of the model once (engine.inference cache)
+# 2. calibrates on the tray frames exactly like BatteryLocator feeds the model
+#    (fisheye remap, tray crop through the Aruco homography, letterbox)
+# 3. writes camera/model/<out>, selectable from cam_pos.detect_model
+# 4. compares INT8 against FP32 on the same frames: mAP@0.5 (FP32 boxes as reference),
+#    centre/angle error in tray mm through the homography, p50/p99 latency
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.geometry import rects_to_array, rects_to_mm
+from engine.homography import HomographyCache, tray_roi
+from engine.inference import OnnxBackend, export_onnx, letterbox, onnx_imgsz
+from engine.postprocess import MaskPostProcessor
+
+IMG_EXT = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+# ------------------------------------------------------------------
+#  Frames, prepared like BatteryLocator.update
+# ------------------------------------------------------------------
+class TrayFrames:
+    def __init__(self, folder, cfg=ldr.usr_cfg["cam_pos"]):
+        self.cfg = cfg
+        self.files = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in IMG_EXT)
+        if not self.files:
+            raise FileNotFoundError(f"No frames in {folder}")
+        h, w = cv2.imread(str(self.files[0])).shape[:2]
+        calib = np.load(ldr.camera_calib / cfg["camera_calib"])
+        K, D = calib["K"], calib["D"]
+        newK, _ = cv2.getOptimalNewCameraMatrix(K, D, (w, h), 0)
+        self.map1, self.map2 = cv2.initUndistortRectifyMap(K, D, None, newK, (w, h), cv2.CV_16SC2)
+        self.size = (w, h)
+        # solved on every frame, the frames are not from one session
+        self.homography = HomographyCache(self.size, {**cfg, "h_cache": 0})
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        """(undistorted frame, tray crop, crop offset, H) per file; H solved per frame, not cached"""
+        w, h = self.size
+        for path in self.files:
+            raw = cv2.imread(str(path))
+            if raw is None or raw.shape[:2] != (h, w):
+                print(f"Skipping {path.name}")
+                continue
+            frame = cv2.remap(raw, self.map1, self.map2, cv2.INTER_LINEAR)
+            H = self.homography.update(frame)
+            roi = tray_roi(H, self.size, self.cfg) if self.cfg["roi_crop"] else None
+            x0, y0, x1, y1 = roi if roi is not None else (0, 0, w, h)
+            yield frame, frame[y0:y1, x0:x1], np.array([x0, y0], np.float32), H
+
+
+class CalibReader:
+    """onnxruntime CalibrationDataReader over the prepared tray crops"""
+
+    def __init__(self, frames, input_name, size):
+        self.input_name = input_name
+        self.size = size
+        self.frames = iter(frames)  # one crop in memory at a time
+
+    def get_next(self):
+        item = next(self.frames, None)
+        if item is None:
+            return None
+        _, crop, _, _ = item
+        return {self.input_name: cv2.dnn.blobFromImage(letterbox(crop, self.size)[0], 1 / 255.0, swapRB=True)}
+
+
+def quantize(fp32_path, out_path, frames):
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    pre_path = Path(fp32_path).with_suffix(".pre.onnx")
+    quant_pre_process(str(fp32_path), str(pre_path))
+    fp32 = OnnxBackend(fp32_path)
+    try:
+        # Conv/MatMul only: the seg head's concat/sigmoid stay in float, keeps the masks sharp
+        quantize_static(str(pre_path), str(out_path), CalibReader(frames, fp32.input_name, fp32.size),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        op_types_to_quantize=["Conv", "MatMul"])
+    finally:
+        pre_path.unlink(missing_ok=True)
+
+    # ultralytics metadata (class names) is lost by the quantiser, copy it over
+    import onnx
+    src, dst = onnx.load(str(fp32_path)), onnx.load(str(out_path))
+    del dst.metadata_props[:]
+    dst.metadata_props.extend(src.metadata_props)
+    onnx.save(dst, str(out_path))
+
+
+# ------------------------------------------------------------------
+#  Report
+# ------------------------------------------------------------------
+def box_iou(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod((rb - lt).clip(0), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def average_precision(hits, scores, n_ref):
+    if n_ref == 0:
+        return float("nan")
+    order = np.argsort(-np.asarray(scores))
+    tp = np.asarray(hits, float)[order]
+    recall = np.cumsum(tp) / n_ref
+    precision = np.cumsum(tp) / np.arange(1, len(tp) + 1)
+    # all-point interpolation
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[1.0], precision, [0.0]])
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1]))
+
+
+def to_mm(res, offset, H, post, guard_px):
+    if H is None or res.polys is None:
+        return np.empty(0), np.empty((0, 3))
+    polys = [(p + offset).astype(np.int32) for p in res.polys]
+    kept, rects = post.process(polys, guard_px)
+    det = rects_to_mm(rects_to_array(rects), res.classes[kept], H)
+    return np.array(kept, int), np.stack([det["x_mm"], det["y_mm"], det["theta"]], axis=1)
+
+
+def compare(fp32, int8, frames, cfg=ldr.usr_cfg["cam_pos"]):
+    post = MaskPostProcessor(frames.size, close=cfg["mask_close"])
+    lat = {"fp32": [], "int8": []}
+    hits, scores, n_ref = {}, {}, {}
+    centre_err, angle_err = [], []
+    for frame, crop, offset, H in frames:
+        out = {}
+        for name, model in (("fp32", fp32), ("int8", int8)):
+            t = time.perf_counter()
+            out[name] = model.predict(crop, cfg["conf"])
+            lat[name].append((time.perf_counter() - t) * 1e3)
+        ref, res = out["fp32"], out["int8"]
+
+        # detection agreement, FP32 boxes are the reference
+        iou = box_iou(res.boxes, ref.boxes) if len(res.boxes) and len(ref.boxes) else np.zeros((len(res.boxes), 0))
+        used = set()
+        for c in np.unique(ref.classes):
+            n_ref[c] = n_ref.get(c, 0) + int((ref.classes == c).sum())
+        for i in np.argsort(-res.scores):
+            c = res.classes[i]
+            cand = [j for j in np.argsort(-iou[i]) if j not in used and ref.classes[j] == c and iou[i, j] >= 0.5] \
+                if iou.shape[1] else []
+            hits.setdefault(c, []).append(bool(cand))
+            scores.setdefault(c, []).append(res.scores[i])
+            if cand:
+                used.add(cand[0])
+
+        # pick accuracy, what arm 1 actually gets
+        _, ref_mm = to_mm(ref, offset, H, post, cfg["guard_px"])
+        _, res_mm = to_mm(res, offset, H, post, cfg["guard_px"])
+        for x, y, theta in ref_mm:
+            if len(res_mm) == 0:
+                break
+            d = np.hypot(res_mm[:, 0] - x, res_mm[:, 1] - y)
+            j = int(np.argmin(d))
+            if d[j] < cfg["short_edge"] / 2:
+                centre_err.append(d[j])
+                da = abs(res_mm[j, 2] - theta) % 180
+                angle_err.append(min(da, 180 - da))
+
+    aps = [average_precision(hits.get(c, []), scores.get(c, []), n) for c, n in n_ref.items()]
+    return {
+        "frames": len(lat["fp32"]),
+        "map50": float(np.nanmean(aps)) if aps else float("nan"),
+        "centre_err": np.array(centre_err),
+        "angle_err": np.array(angle_err),
+        "latency": {k: np.array(v[1:] or v) for k, v in lat.items()},  # first run is warm-up
+    }
+
+
+def report(stats, fp32_path, int8_path):
+    lines = ["# INT8 quantisation report", "",
+             f"- FP32: `{Path(fp32_path).name}`",
+             f"- INT8: `{Path(int8_path).name}`",
+             f"- Frames: {stats['frames']}", "",
+             "| model | p50 (ms) | p99 (ms) | FPS (p50) |", "|---|---|---|---|"]
+    for name, lat in stats["latency"].items():
+        p50, p99 = np.percentile(lat, [50, 99])
+        lines.append(f"| {name} | {p50:.1f} | {p99:.1f} | {1e3 / p50:.1f} |")
+    speedup = np.median(stats["latency"]["fp32"]) / np.median(stats["latency"]["int8"])
+    ce, ae = stats["centre_err"], stats["angle_err"]
+    lines += ["", f"- Speed-up (p50): x{speedup:.2f}",
+              f"- mAP@0.5 vs FP32: {stats['map50']:.3f}",
+              f"- Matched batteries: {len(ce)}"]
+    if len(ce):
+        lines += [f"- Centre error (mm): mean {ce.mean():.2f}, p95 {np.percentile(ce, 95):.2f}, max {ce.max():.2f}",
+                  f"- Angle error (deg): mean {ae.mean():.2f}, p95 {np.percentile(ae, 95):.2f}, max {ae.max():.2f}"]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    cfg = ldr.usr_cfg["cam_pos"]
+    parser = argparse.ArgumentParser(description="INT8 static quantisation of the detection model")
+    parser.add_argument("--frames", required=True, help="folder of raw tray frames from the position camera")
+    parser.add_argument("--model", default=cfg["detect_model"], help="model in camera/model (.pt or .onnx)")
+    parser.add_argument("--out", default=None, help="output name in camera/model, default <stem>_int8.onnx")
+    parser.add_argument("--calib-frames", type=int, default=100, help="max frames used for calibration")
+    args = parser.parse_args()
+
+    model_path = ldr.detect_model / args.model
+    fp32_path = model_path if model_path.suffix == ".onnx" else export_onnx(model_path, onnx_imgsz(cfg))
+    out_path = ldr.detect_model / (args.out or f"{model_path.stem}_int8.onnx")
+
+    frames = TrayFrames(args.frames, cfg)
+    calib = TrayFrames(args.frames, cfg)
+    calib.files = calib.files[::max(1, len(calib.files) // args.calib_frames)][:args.calib_frames]
+    print(f"Calibrating on {len(calib)} frames...")
+    quantize(fp32_path, out_path, calib)
+    print(f"💾 Saved INT8 model to: {out_path}")
+
+    stats = compare(OnnxBackend(fp32_path), OnnxBackend(out_path), frames, cfg)
+    text = report(stats, fp32_path, out_path)
+    report_path = Path(args.frames) / f"{out_path.stem}_report.md"
+    report_path.write_text(text, encoding="utf-8")
+    print(text)
+    print(f"Report saved to: {report_path}")
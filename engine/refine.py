@@ -0,0 +1,150 @@
+# ------------------------------------------------------------------
+#  Coarse-to-fine pick: the target re-measured on a small crop of a 1080p frame
+# ------------------------------------------------------------------
+# BatteryLocator detects every frame at the cam_pos size (calib_480). Only when a target
+# goes out to arm 1, PickRefiner switches the same camera to refine_width x refine_height
+# for one frame (engine.camera.grab_mode), finds the tags on the raw big frame (corners
+# undistorted with refine_calib, own homography cache next to it), undistorts just the
+# refine_crop_mm square around the target and runs the model on that crop. The refined
+# centre / angle replace the coarse ones when they agree within refine_max_mm, otherwise
+# the coarse target is sent unchanged.
+import time
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.camera import grab_mode
+from engine.geometry import rects_to_array, rects_to_mm
+from engine.homography import HomographyCache
+from engine.postprocess import MaskPostProcessor
+from engine.undistort import PointLens
+
+DEBUG = ldr.usr_cfg["main"]["debug"]
+
+REUSE_S = 10.0  # a refined target is answered from the cache at most this long
+REUSE_DEG = 5.0  # and only while the coarse angle stays this close
+
+
+class PickRefiner:
+    def __init__(self, bl, cfg=None):
+        self.bl = bl  # BatteryLocator: camera, model and their locks
+        self.cfg = cfg = bl.cfg if cfg is None else cfg
+        calib = np.load(ldr.camera_calib / cfg["refine_calib"])
+        self.K, self.D = calib["K"], calib["D"]
+        self.size = (cfg["refine_width"], cfg["refine_height"])
+        self.newK, _ = cv2.getOptimalNewCameraMatrix(self.K, self.D, self.size, 0)
+        # tags found on the raw big frame, only their corners undistorted
+        self.homography = HomographyCache(self.size, {**cfg, "camera_calib": cfg["refine_calib"]},
+                                          lens=PointLens(self.K, self.D, self.newK))
+        self.crop = None  # (x0, y0, undistorted crop) of the last measure()
+        self.shift_mm = 0.0  # coarse -> refined centre of the last refine()
+        self.last = None  # (coarse target, what refine() returned for it, time.monotonic())
+        self.reused = 0  # re-sends of the same target answered from self.last
+        self.refined = 0  # targets sent refined / coarse
+        self.coarse = 0
+
+    def crop_box(self, H, x, y):
+        """Undistorted px box (x0, y0, x1, y1) of the refine_crop_mm square around (x, y) mm"""
+        r = self.cfg["refine_crop_mm"] / 2
+        mm = np.array([[[x - r, y - r], [x + r, y - r], [x + r, y + r], [x - r, y + r]]], np.float64)
+        px = cv2.perspectiveTransform(mm, np.linalg.inv(H))[0]
+        x0, y0 = np.maximum(np.floor(px.min(axis=0)), 0).astype(int)
+        x1, y1 = np.minimum(np.ceil(px.max(axis=0)), self.size).astype(int)
+        if x1 - x0 < 32 or y1 - y0 < 32:  # target off the frame, bad H
+            return None
+        return x0, y0, x1, y1
+
+    def undistort_crop(self, raw, box):
+        """Only the box of the undistorted (newK) image, through a remap table of the crop size"""
+        x0, y0, x1, y1 = box
+        K_crop = self.newK.copy()
+        K_crop[0, 2] -= x0
+        K_crop[1, 2] -= y0
+        map1, map2 = cv2.initUndistortRectifyMap(self.K, self.D, None, K_crop, (x1 - x0, y1 - y0), cv2.CV_16SC2)
+        return cv2.remap(raw, map1, map2, cv2.INTER_LINEAR)
+
+    def measure(self, raw, target):
+        """
+        raw: frame at the refine size, target: coarse (x, y, theta, cls) in tray mm.
+        Refined (4,) array, None when the tags or a battery near the target aren't found.
+        """
+        cfg = self.cfg
+        H = self.homography.update(raw)
+        if H is None:
+            return None
+        box = self.crop_box(H, target[0], target[1])
+        if box is None:
+            return None
+        x0, y0, x1, y1 = box
+        crop = self.undistort_crop(raw, box)
+        self.crop = (x0, y0, crop)
+        with self.bl.model_lock:
+            result = self.bl.model.predict(crop, cfg["conf"], imgsz=cfg["roi_imgsz"])
+
+        # once per pick, a post-processor of the crop size is cheap
+        post = MaskPostProcessor((x1 - x0, y1 - y0), close=cfg["mask_close"])
+        if result.rects is not None:
+            kept, rects = post.process_rects(result.rects, cfg["guard_px"])
+        elif result.polys is not None:
+            kept, rects = post.process([p.astype(np.int32) for p in result.polys], cfg["guard_px"])
+        else:  # boxes only, no angle to refine
+            return None
+        if not rects:
+            return None
+        rects = rects_to_array(rects)
+        rects[:, :2] += (x0, y0)
+        det = rects_to_mm(rects, result.classes[kept], H)
+        d = np.hypot(det["x_mm"] - target[0], det["y_mm"] - target[1])
+        i = int(np.argmin(d))
+        if d[i] > cfg["refine_max_mm"]:
+            return None
+        return np.array([det["x_mm"][i], det["y_mm"][i], det["theta"][i], det["cls"][i]], float)
+
+    def _same_target(self, target) -> bool:
+        """target is the last one again (the picker re-sends its head while arm 1 is busy)"""
+        if self.last is None:
+            return False
+        coarse, _, t = self.last
+        if time.monotonic() - t > REUSE_S:
+            return False
+        turn = abs((coarse[2] - target[2] + 90) % 180 - 90)  # theta is [0, 180)
+        return (coarse[3] == target[3] and turn <= REUSE_DEG
+                and np.hypot(*(coarse[:2] - target[:2])) <= self.cfg["refine_max_mm"])
+
+    def forget(self, det=None):
+        """
+        Drop the cached target. det: the rows (tracks / detections) of a fresh frame, the cache
+        is only dropped when none of them is at the cached spot anymore (picked, tray emptied).
+        """
+        if self.last is None:
+            return
+        if det is not None:
+            coarse = self.last[0]
+            if (np.hypot(det["x_mm"] - coarse[0], det["y_mm"] - coarse[1]) <= self.cfg["refine_max_mm"]).any():
+                return
+        self.last = None
+
+    def refine(self, target):
+        """
+        The target as measured on one big frame, or unchanged when that fails. A target within
+        refine_max_mm of the last one gets the last answer, without another mode switch.
+        """
+        target = np.asarray(target, float)
+        if self._same_target(target):
+            self.reused += 1
+            return self.last[1]
+        t = time.perf_counter()
+        with self.bl.cap_lock:  # the grabber / prep stage waits for the mode switch
+            raw = grab_mode(self.bl.cap, *self.size)
+        fine = None if raw is None else self.measure(raw, target)
+        if fine is None:
+            self.coarse += 1
+            if DEBUG: print(f"Refine: kept the coarse target ({(time.perf_counter() - t) * 1e3:.0f} ms)")
+            self.last = (target, target, time.monotonic())
+            return target
+        self.refined += 1
+        self.shift_mm = float(np.hypot(*(fine[:2] - target[:2])))
+        if DEBUG: print(f"Refine: moved {self.shift_mm:.2f} mm ({(time.perf_counter() - t) * 1e3:.0f} ms)")
+        self.last = (target, fine, time.monotonic())
+        return fine
@@ -0,0 +1,67 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class OverlayRenderer:
+    """
+    Draws the detection overlay (tag borders, masks, rects, labels, FPS) on a copy of the
+    last detection frame. Kept apart from BatteryLocator.update so the drawing cost is only
+    paid for frames that are actually shown, at most preview_fps times per second.
+    """
+
+    def __init__(self, frame_size, preview_fps=15.0):
+        w_img, h_img = frame_size
+        self.canvas = np.empty((h_img, w_img, 3), np.uint8)
+        self.period = 1.0 / preview_fps if preview_fps > 0 else 0.0
+        self.last_render = 0.0
+
+    def due(self) -> bool:
+        """True when a new preview frame should be shown (display rate limit)"""
+        return time.monotonic() - self.last_render >= self.period
+
+    def draw(self, frame, det, names, rects=None, boxes=None, fps=0.0,
+             show_masks=True, post=None, homography=None, info="", crops=None):
+        self.last_render = time.monotonic()
+        canvas = self.canvas
+        np.copyto(canvas, frame)
+
+        # draw tag border
+        if homography is not None:
+            homography.draw(canvas)
+
+        if rects is not None:
+            if show_masks and post is not None:
+                post.blend(canvas, crops=crops)  # all masks in one pass
+            for rect, d in zip(rects, det):
+                (xc, yc), _, _ = rect
+                X_mm, Y_mm, theta, cls, _ = d.item()
+                xc, yc = int(xc), int(yc)
+                if show_masks:
+                    cv2.drawContours(canvas, [cv2.boxPoints(rect).astype(int)],
+                                     -1, (0, 100, 255), 1)
+                cv2.circle(canvas, (xc, yc), 2, (0, 255, 255), -1)
+                cv2.putText(canvas, names[cls], (xc - 20, yc - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.42, (100, 255, 100), 1, cv2.LINE_AA)
+                cv2.putText(canvas, f"X:{X_mm:.0f}", (xc - 20, yc),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.42, (255, 255, 0), 1, cv2.LINE_AA)
+                cv2.putText(canvas, f"Y:{Y_mm:.0f}", (xc - 20, yc + 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.42, (255, 255, 0), 1, cv2.LINE_AA)
+                cv2.putText(canvas, f"{theta:.0f}'", (xc - 20, yc + 20),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.42, (0, 255, 255), 1, cv2.LINE_AA)
+
+        elif boxes is not None:  # ---------- fallback to boxes --------------------
+            for (x1, y1, x2, y2), d in zip(boxes, det):
+                cx, cy = int((x1 + x2) / 2), int((y1 + y2) / 2)
+                cv2.rectangle(canvas, (int(x1), int(y1)), (int(x2), int(y2)), (0, 100, 255), 2)
+                cv2.circle(canvas, (cx, cy), 3, (0, 255, 255), -1)
+                cv2.putText(canvas, f"{d['x_mm']:.1f},{d['y_mm']:.1f}", (cx + 6, cy),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+
+        cv2.putText(canvas, f"FPS: {int(fps)}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2,
+                    cv2.LINE_AA)
+        if info:  # debug stats under the FPS
+            cv2.putText(canvas, info, (10, 52), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1,
+                        cv2.LINE_AA)
+        return canvas
@@ -0,0 +1,256 @@
+# ------------------------------------------------------------------
+#  Record / replay the position camera for offline runs of BatteryLocator
+# ------------------------------------------------------------------
+# python -m engine.replay record --out recordings/tray01 [--seconds 60]
+# python -m engine.replay play recordings/tray01.avi [--realtime] [--loop] [--show] [--pipeline]
+#
+# record: raw (pre-remap) frames as MJPEG in <out>.avi, grab times in <out>.ts.npy
+# play:   runs the recording through BatteryLocator.update() at max speed (or at the
+#         recorded pace with --realtime) and prints FPS, per-frame latency and how stable
+#         the detections are, so model / calibration / homography changes can be compared
+#         without the station
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+
+TS_SUFFIX = ".ts.npy"
+
+
+def ts_path(video_path) -> Path:
+    """recordings/tray01.avi -> recordings/tray01.ts.npy"""
+    video_path = Path(video_path)
+    return video_path.with_name(video_path.stem + TS_SUFFIX)
+
+
+class Recorder:
+    """Raw camera frames to MJPEG/AVI + their time.monotonic() grab times"""
+
+    def __init__(self, out, frame_size, fps=30.0, quality=95):
+        self.path = Path(out).with_suffix(".avi")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.writer = cv2.VideoWriter(str(self.path), cv2.VideoWriter_fourcc(*"MJPG"), fps, frame_size)
+        self.writer.set(cv2.VIDEOWRITER_PROP_QUALITY, quality)
+        if not self.writer.isOpened():
+            raise RuntimeError(f"Cannot write {self.path}")
+        self.timestamps = []
+
+    def write(self, frame, ts=None):
+        self.writer.write(frame)
+        self.timestamps.append(time.monotonic() if ts is None else ts)
+
+    def close(self):
+        self.writer.release()
+        ts = np.asarray(self.timestamps, np.float64)
+        np.save(ts_path(self.path), ts - ts[0] if len(ts) else ts)
+
+
+class ReplayCapture:
+    """
+    cv2.VideoCapture stand-in over a recording, can be given to BatteryLocator(cap=...).
+    realtime=True paces read() on the recorded grab times, otherwise frames come as fast
+    as they are asked for. isOpened() turns False at the end unless loop=True.
+    """
+
+    def __init__(self, path, realtime=False, loop=False):
+        self.path = Path(path)
+        self.cap = cv2.VideoCapture(str(self.path))
+        if not self.cap.isOpened():
+            raise FileNotFoundError(f"Cannot open {self.path}")
+        ts_file = ts_path(self.path)
+        if ts_file.exists():
+            self.timestamps = np.load(ts_file)
+        else:  # plain video, use its nominal fps
+            n = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.timestamps = np.arange(n) / (self.cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0  # next frame
+        self._opened = True
+        self._t0 = None
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        ok, frame = self.cap.read()
+        if not ok and self.loop and self.index > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.index, self._t0 = 0, None
+            ok, frame = self.cap.read()
+        if not ok:
+            self._opened = False
+            return False, None
+        if self.realtime:
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+            if self.index < len(self.timestamps):
+                wait = self._t0 + self.timestamps[self.index] - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+        self.index += 1
+        return True, frame
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self._opened = False
+        self.cap.release()
+
+
+# ------------------------------------------------------------------
+#  Stats
+# ------------------------------------------------------------------
+def theta_std(theta):
+    """Circular std (deg) of long-edge angles, which wrap at 180"""
+    r = np.abs(np.exp(2j * np.radians(theta)).mean())
+    return float(np.degrees(np.sqrt(-2 * np.log(max(r, 1e-12)))) / 2)
+
+
+def stability(frames_det, gate_mm=15.0):
+    """
+    frames_det: DET_DTYPE array per frame. Detections are linked across frames to the
+    nearest battery of the first frame it was seen in (under gate_mm); returns the count
+    stability and the per-battery jitter (std) of x, y and theta.
+    """
+    counts = np.array([len(d) for d in frames_det])
+    anchors, samples = [], []  # (x, y) per battery, list of (x, y, theta) per battery
+    for det in frames_det:
+        for x, y, theta, _, _ in det.tolist():
+            d = [np.hypot(x - ax, y - ay) for ax, ay in anchors]
+            if d and min(d) < gate_mm:
+                samples[int(np.argmin(d))].append((x, y, theta))
+            else:
+                anchors.append((x, y))
+                samples.append([(x, y, theta)])
+    seen = [np.array(s) for s in samples if len(s) >= max(3, len(frames_det) // 10)]
+    jitter = np.array([[s[:, 0].std(), s[:, 1].std(), theta_std(s[:, 2])] for s in seen]) \
+        if seen else np.empty((0, 3))
+    mode = np.bincount(counts).argmax() if len(counts) else 0
+    return {
+        "count_mean": counts.mean() if len(counts) else 0.0,
+        "count_mode": int(mode),
+        "count_stable": float((counts == mode).mean()) if len(counts) else 0.0,
+        "batteries": len(seen),
+        "jitter": jitter,
+    }
+
+
+def play(path, realtime=False, loop=False, show=False, profile=False, cfg=ldr.usr_cfg["cam_pos"]):
+    from engine.detection import BatteryLocator
+
+    cap = ReplayCapture(path, realtime, loop)
+    # no grabber thread: at max speed it would just drop the frames we want to measure
+    bl = BatteryLocator({**cfg, "grab_thread": 0, "profile": profile or cfg["profile"]}, cap=cap)
+    if bl.stop:
+        return None
+    source = bl
+    if cfg["pipeline"]:
+        from engine.pipeline import DetectionPipeline
+        source = DetectionPipeline(bl, cfg).start()
+    latency, frames_det, fresh = [], [], 0
+    t_start = time.perf_counter()
+    try:
+        while cap.isOpened() or (source is not bl and source.pending()):
+            t = time.perf_counter()
+            frame = source.update()
+            if frame is None:
+                continue
+            latency.append((time.perf_counter() - t) * 1e3)
+            frames_det.append(bl.last_detections.copy())
+            fresh += bl.fresh
+            if show:
+                bl.show()
+                if cv2.waitKey(1) & 0xFF == 27:  # ESC
+                    break
+    finally:
+        if source is not bl:
+            source.stop()
+        bl.release()
+    elapsed = time.perf_counter() - t_start
+    lat = np.array(latency[1:] or latency)  # first frame pays for the warm-up
+    return {
+        "frames": len(latency),
+        "fps": len(latency) / elapsed if elapsed > 0 else 0.0,
+        "latency": lat,
+        "model_runs": fresh,
+        "stages": bl.timer.summary(),
+        **stability(frames_det),
+    }
+
+
+def print_stats(stats):
+    lat = stats["latency"]
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if len(lat) else (0, 0, 0)
+    print(f"Frames: {stats['frames']}  FPS: {stats['fps']:.1f}  model runs: {stats['model_runs']}")
+    print(f"Latency (ms): mean {lat.mean() if len(lat) else 0:.1f}  p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}")
+    print(f"Detections/frame: mean {stats['count_mean']:.2f}  mode {stats['count_mode']}  "
+          f"stable {100 * stats['count_stable']:.0f}% of frames")
+    jitter = stats["jitter"]
+    if len(jitter):
+        print(f"Jitter over {stats['batteries']} batteries (std, mean / max): "
+              f"x {jitter[:, 0].mean():.2f} / {jitter[:, 0].max():.2f} mm  "
+              f"y {jitter[:, 1].mean():.2f} / {jitter[:, 1].max():.2f} mm  "
+              f"theta {jitter[:, 2].mean():.2f} / {jitter[:, 2].max():.2f} deg")
+    for stage, st in stats["stages"].items():
+        print(f"  {stage:<10} n {st['n']:>6}  mean {st['mean']:7.2f}  p50 {st['p50']:7.2f}  "
+              f"p95 {st['p95']:7.2f}  p99 {st['p99']:7.2f}  max {st['max']:7.2f} ms")
+
+
+def record(out, seconds=0.0, cfg=ldr.usr_cfg["cam_pos"]):
+    from engine.camera import open_camera
+    cap = open_camera(cfg)
+    ok, frame = cap.read()
+    if not ok:
+        raise RuntimeError(f"Cannot read camera {cfg['idx']}")
+    h, w = frame.shape[:2]
+    rec = Recorder(out, (w, h), cap.get(cv2.CAP_PROP_FPS) or 30.0)
+    print(f"Recording {w}x{h} to {rec.path}, ESC to stop")
+    t_end = time.monotonic() + seconds if seconds > 0 else float("inf")
+    try:
+        while ok and time.monotonic() < t_end:
+            rec.write(frame)
+            cv2.imshow("Recording", frame)
+            if cv2.waitKey(1) & 0xFF == 27:
+                break
+            ok, frame = cap.read()
+    finally:
+        rec.close()
+        cap.release()
+        cv2.destroyAllWindows()
+    print(f"💾 Saved {len(rec.timestamps)} frames to: {rec.path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record / replay the position camera")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("record", help="record raw frames from the cam_pos camera")
+    p_rec.add_argument("--out", required=True, help="output path, .avi added")
+    p_rec.add_argument("--seconds", type=float, default=0.0, help="stop after this long, 0 = until ESC")
+    p_play = sub.add_parser("play", help="run a recording through BatteryLocator")
+    p_play.add_argument("video", help="recording .avi (or any video file)")
+    p_play.add_argument("--realtime", action="store_true", help="replay at the recorded pace")
+    p_play.add_argument("--loop", action="store_true", help="restart at the end (ESC to stop, with --show)")
+    p_play.add_argument("--show", action="store_true", help="show the overlay")
+    p_play.add_argument("--profile", action="store_true", help="per-stage timings (cam_pos.profile)")
+    p_play.add_argument("--pipeline", action="store_true", help="staged threads (cam_pos.pipeline)")
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        record(args.out, args.seconds)
+    else:
+        cfg = ldr.usr_cfg["cam_pos"]
+        stats = play(args.video, args.realtime, args.loop, args.show, args.profile,
+                     {**cfg, "pipeline": args.pipeline or cfg["pipeline"]})
+        if stats is None:
+            print("Recording could not be opened")
+        else:
+            print_stats(stats)
@@ -0,0 +1,346 @@
+# ------------------------------------------------------------------
+#  Synthetic position camera: rendered tray frames with known battery poses
+# ------------------------------------------------------------------
+# python -m engine.synthetic [--batteries 12] [--shuffle 30] [--no-distort] [--noise 2] [--out tray.png]
+#
+# The tray is drawn top-down in mm (tags from aruco/4x4_1000-<id>.svg at tag_size, battery
+# sprites at known x, y, theta) and put in the camera view, distorted with the K/D of
+# cam_pos.camera_calib, with one remap. SyntheticCapture hands the frames out like
+# cv2.VideoCapture, so BatteryLocator(cap=SyntheticCapture(...)) runs without the station
+# and every frame comes with its ground truth (`poses`, `H`).
+import argparse
+import re
+import time
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+import engine.loader as ldr
+from engine.homography import tag_world_corners, tray_world_corners
+from engine.inference import SegResult
+from engine.postprocess import moments_rect
+from engine.undistort import PointLens
+
+BATTERY_MM = (48.5, 26.5)  # 9V battery, long x short
+TERMINAL_MM = 3.0  # snap terminals sticking out of one short end
+LABEL_COLORS = [(40, 40, 160), (150, 60, 20), (20, 110, 220), (40, 140, 40), (120, 40, 120)]  # BGR
+TRAY_BGR = (235, 235, 235)
+TABLE_BGR = (90, 90, 90)
+
+
+def load_tag(tag_id, px, folder=ldr.aruco_dir):
+    """Gray image (px x px) of the printed tag: the <rect> grid of 4x4_1000-<id>.svg, border included"""
+    path = folder / f"4x4_1000-{tag_id}.svg"
+    if not path.exists():  # same bits, the 4x4 dictionaries share their first ids
+        d = aruco.getPredefinedDictionary(aruco.DICT_4X4_1000)
+        return aruco.generateImageMarker(d, tag_id, px, borderBits=1)
+    svg = path.read_text(encoding="utf-8")
+    vw, vh = map(float, re.search(r'viewBox="0 0 ([\d.]+) ([\d.]+)"', svg).groups())
+    img = np.zeros((px, px), np.uint8)
+    for rect in re.findall(r"<rect [^>]*>", svg):
+        attr = dict(re.findall(r'(\w+)="([^"]*)"', rect))
+        x, y = float(attr.get("x", 0)) / vw * px, float(attr.get("y", 0)) / vh * px
+        w, h = float(attr["width"]) / vw * px, float(attr["height"]) / vh * px
+        color = 255 if attr.get("fill") == "white" else 0
+        img[int(round(y)):int(round(y + h)), int(round(x)):int(round(x + w))] = color
+    return img
+
+
+def camera_view(frame_size, cfg=ldr.usr_cfg["cam_pos"]):
+    """
+    H (undistorted px -> tray mm) of a camera looking down at the tray: tray ~75% of the
+    frame, slightly rotated and in perspective, tray y up in the image like on the station
+    """
+    w, h = frame_size
+    L, W = tray_world_corners(cfg)[2]
+    src = np.float32([[0.12 * w, 0.14 * h], [0.86 * w, 0.12 * h], [0.88 * w, 0.88 * h], [0.10 * w, 0.85 * h]])
+    return cv2.getPerspectiveTransform(src, np.float32([[0, W], [L, W], [L, 0], [0, 0]]))
+
+
+def random_poses(n, cfg=ldr.usr_cfg["cam_pos"], seed=0, battery_mm=BATTERY_MM, gap_mm=2.0):
+    """
+    Up to n non-overlapping (x, y, theta) in the tray, clear of the tags. Fewer when they
+    don't fit: a 9V tray takes ~15 at random, use a smaller battery_mm to go further.
+    """
+    rng = np.random.default_rng(seed)
+    L, W = cfg["tray_length"], cfg["tray_width"]
+    ts = cfg["tag_size"]
+    r = np.hypot(*battery_mm) / 2  # bounding circle
+    lo = np.array([battery_mm[1] / 2 + gap_mm, battery_mm[1] / 2 + gap_mm])
+    hi = np.array([L + ts, W + ts]) - lo
+    tags = np.array([[0, 0], [L, 0], [L, W], [0, W]]) + ts / 2
+    poses, rects = [], []
+    for _ in range(20000):
+        p = (rng.uniform(lo[0], hi[0]), rng.uniform(lo[1], hi[1]), rng.uniform(0, 180))
+        box = cv2.boxPoints(((p[0], p[1]), battery_mm, p[2]))
+        if (box < 0).any() or (box > [L + ts, W + ts]).any():
+            continue
+        if (np.hypot(*(tags - p[:2]).T) < r + ts * 0.75).any():
+            continue
+        grown = ((p[0], p[1]), (battery_mm[0] + gap_mm, battery_mm[1] + gap_mm), p[2])
+        if any(cv2.rotatedRectangleIntersection(grown, q)[0] != cv2.INTERSECT_NONE for q in rects):
+            continue
+        poses.append(p)
+        rects.append(grown)
+        if len(poses) == n:
+            break
+    return np.array(poses, np.float64).reshape(-1, 3)
+
+
+def pose_error(det, poses, battery_mm=BATTERY_MM):
+    """Centre (mm) and angle (deg) error of every ground-truth battery against its nearest detection"""
+    ce, ae = [], []
+    for x, y, theta in poses:
+        if len(det) == 0:
+            break
+        d = np.hypot(det["x_mm"] - x, det["y_mm"] - y)
+        j = int(np.argmin(d))
+        if d[j] > battery_mm[1] / 2:
+            continue
+        ce.append(d[j])
+        da = abs(det["theta"][j] - theta) % 180
+        ae.append(min(da, 180 - da))
+    return np.array(ce), np.array(ae)
+
+
+class ColorBackend:
+    """
+    Stand-in for the model on synthetic frames: the saturated battery labels as masks
+    (tags, tray and terminals are gray). Same predict() as the inference backends, so it
+    can be given as BatteryLocator(model=...) to test the geometry without a model.
+    """
+
+    names = {0: "9V"}
+
+    def __init__(self, min_area=200, rects=False, stride=4):
+        self.min_area = min_area
+        self.rects = rects  # mask_moments: rects from the masks at 1/stride, like the model protos
+        self.stride = stride
+
+    def predict(self, img, conf=0.0, imgsz=None) -> SegResult:
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (0, 80, 40), (180, 255, 255))
+        cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        polys = [c.reshape(-1, 2).astype(np.float32) for c in cnts if cv2.contourArea(c) > self.min_area]
+        boxes = np.array([[*p.min(0), *p.max(0)] for p in polys], np.float32).reshape(-1, 4)
+        res = SegResult(polys=polys, boxes=boxes, scores=np.ones(len(polys), np.float32),
+                        classes=np.zeros(len(polys), int), names=self.names)
+        if self.rects:
+            res.rects, res.polys = self._low_res_rects(polys, boxes), None
+        return res
+
+    def _low_res_rects(self, polys, boxes):
+        # every battery filled on its own (the model masks are per instance), box grid-aligned
+        # to the stride and shrunk with INTER_AREA: soft 0-1 masks like the sigmoid of the protos
+        s = self.stride
+        rects = np.zeros((len(polys), 5), np.float32)
+        for i, (p, box) in enumerate(zip(polys, boxes)):
+            x0, y0 = (box[:2] // s * s).astype(int)
+            w, h = (-(-(box[2:] + 1 - (x0, y0)) // s) * s).astype(int)
+            crop = np.zeros((h, w), np.uint8)
+            cv2.fillPoly(crop, [p.astype(np.int32)], 255, offset=(-x0, -y0))
+            soft = cv2.resize(crop, (w // s, h // s), interpolation=cv2.INTER_AREA).astype(np.float32) / 255
+            r = moments_rect(soft)
+            if r is not None:
+                rects[i] = r
+                rects[i, :2] = (rects[i, :2] + 0.5) * s - 0.5 + (x0, y0)
+                rects[i, 2:4] *= s
+        return rects
+
+
+class TrayScene:
+    """
+    Renders raw camera frames of the tray. Everything is drawn top-down at px_mm pixels per
+    mm first (tags, tray, batteries), then one remap table (raw px -> undistorted px (K, D)
+    -> mm (H) -> top-down px) makes the camera frame, so the cost per frame hardly grows with
+    the number of batteries. The noise comes from a bank of frames made once.
+    """
+
+    def __init__(self, frame_size=(640, 480), cfg=ldr.usr_cfg["cam_pos"], calib=None, H=None,
+                 distort=True, noise=2.0, px_mm=4.0, battery_mm=BATTERY_MM, noise_bank=8):
+        self.cfg = cfg
+        self.frame_size = frame_size
+        self.noise = noise
+        self.px_mm = px_mm
+        self.battery_mm = battery_mm
+        self.H = camera_view(frame_size, cfg) if H is None else H  # undistorted px -> mm (truth)
+        w, h = frame_size
+        L, W = tray_world_corners(cfg)[2]
+        self.top = np.empty((int(round(W * px_mm)), int(round(L * px_mm)), 3), np.uint8)
+        self._tray = self._draw_tray()
+        self.lens = None
+        u, v = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+        und = np.stack([u, v], axis=-1).reshape(-1, 2)  # raw px, = undistorted px without a lens
+        if distort:
+            calib = np.load(ldr.camera_calib / (calib or cfg["camera_calib"]))
+            K, D = calib["K"], calib["D"]
+            newK, _ = cv2.getOptimalNewCameraMatrix(K, D, (w, h), 0)
+            self.lens = PointLens(K, D, newK)
+            und = self.lens.undistort(und)
+        mm = cv2.perspectiveTransform(und[None], self.H)[0]
+        self.maps = cv2.convertMaps((mm * px_mm).reshape(h, w, 2).astype(np.float32), None, cv2.CV_16SC2)
+        self._noise = []
+        if noise > 0:
+            for _ in range(noise_bank):
+                n = np.empty((h, w, 3), np.int16)
+                cv2.randn(n, (0, 0, 0), (noise,) * 3)
+                self._noise.append(n)
+        self._clean = None
+        self._frames = 0
+
+    def _draw_tray(self):
+        s = self.px_mm
+        tray = np.empty_like(self.top)
+        tray[:] = TRAY_BGR
+        for tid in self.cfg["tag_ids"]:
+            px = int(round(self.cfg["tag_size"] * s))
+            # tag_world_corners TL is the corner with the larger y, rows grow with y here
+            tag = np.flipud(load_tag(tid, px))
+            x0, y0 = (tag_world_corners(tid, self.cfg)[3] * s).round().astype(int)
+            tray[y0:y0 + px, x0:x0 + px] = tag[..., None]
+        return tray
+
+    def _draw_battery(self, img, x, y, theta, color):
+        s = self.px_mm
+        lx, ly = self.battery_mm
+        c, sn = np.cos(np.radians(theta)), np.sin(np.radians(theta))
+        ax, ay = np.array([c, sn]), np.array([-sn, c])  # long / short edge direction
+
+        def poly(pts):
+            return (np.array(pts) * s * 16).round().astype(np.int32)  # 4 bits subpixel
+
+        centre = np.array([x, y])
+        body = cv2.boxPoints(((x, y), (lx, ly), theta))
+        cv2.fillConvexPoly(img, poly(body), color, cv2.LINE_AA, 4)
+        # printed band across the label, same hue family so it is still "battery"
+        band = cv2.boxPoints((tuple(centre - ax * lx * 0.15), (lx * 0.12, ly), theta))
+        cv2.fillConvexPoly(img, poly(band), tuple(min(255, int(v * 1.5) + 30) for v in color), cv2.LINE_AA, 4)
+        # snap terminals on the +long end, outside the body outline
+        for off in (-0.22, 0.22):
+            t = centre + ax * (lx / 2 + TERMINAL_MM / 2) + ay * ly * off
+            cv2.circle(img, tuple(poly(t)), int(round(3.5 * s * 16)), (170, 170, 170), -1, cv2.LINE_AA, 4)
+
+    def render(self, poses, seed=0):
+        """Noise-free raw camera frame with batteries at poses (x, y, theta in tray mm / deg)"""
+        np.copyto(self.top, self._tray)
+        for i, (x, y, theta) in enumerate(poses):
+            self._draw_battery(self.top, x, y, theta, LABEL_COLORS[(i + seed) % len(LABEL_COLORS)])
+        self._clean = cv2.remap(self.top, *self.maps, cv2.INTER_LINEAR, borderValue=TABLE_BGR)
+        return self._clean
+
+    def frame(self):
+        """The last render() with the next noise frame of the bank added"""
+        self._frames += 1
+        if not self._noise:
+            return self._clean.copy()
+        return cv2.add(self._clean, self._noise[self._frames % len(self._noise)], dtype=cv2.CV_8U)
+
+
+class SyntheticCapture:
+    """
+    cv2.VideoCapture stand-in over TrayScene, can be given to BatteryLocator(cap=...).
+    `poses` is the ground truth of the last frame read. shuffle_every > 0 puts the batteries
+    somewhere else every that many frames (motion gate / tracker), fps > 0 paces read(),
+    frames > 0 closes the capture after that many frames. modes: other frame sizes the
+    "camera" switches to through set(width / height), {(w, h): calib file}, same poses.
+    """
+
+    def __init__(self, batteries=12, frame_size=(640, 480), cfg=ldr.usr_cfg["cam_pos"], seed=0,
+                 shuffle_every=0, fps=0.0, frames=0, modes=None, **scene_kw):
+        self.scene = TrayScene(frame_size, cfg, **scene_kw)
+        self._scenes = {tuple(frame_size): self.scene}
+        self._scene_kw = scene_kw
+        self.modes = modes or {}
+        self._size = list(frame_size)  # asked through set()
+        self.cfg = cfg
+        self.batteries = batteries
+        self.seed = seed
+        self.shuffle_every = shuffle_every
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.frames = frames
+        self.index = 0
+        self.poses = random_poses(batteries, cfg, seed, self.scene.battery_mm)
+        self._rendered = False  # static scene: rendered once, only the noise changes
+        self._next = 0.0
+        self._opened = True
+
+    @property
+    def H(self):
+        return self.scene.H
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        if not self._opened or (self.frames and self.index >= self.frames):
+            self._opened = False
+            return False, None
+        if self.shuffle_every and self.index and self.index % self.shuffle_every == 0:
+            self.seed += 1
+            self.poses = random_poses(self.batteries, self.cfg, self.seed, self.scene.battery_mm)
+            self._rendered = False
+        if not self._rendered:
+            self.scene.render(self.poses, self.seed)
+            self._rendered = True
+        if self.period:
+            wait = self._next - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._next = max(self._next, time.monotonic()) + self.period
+        self.index += 1
+        return True, self.scene.frame()
+
+    def get(self, prop):
+        w, h = self.scene.frame_size
+        return {cv2.CAP_PROP_FRAME_WIDTH: w, cv2.CAP_PROP_FRAME_HEIGHT: h,
+                cv2.CAP_PROP_FPS: 1.0 / self.period if self.period else 0.0}.get(prop, 0.0)
+
+    def set(self, prop, value):
+        if prop not in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            return False
+        self._size[prop == cv2.CAP_PROP_FRAME_HEIGHT] = int(value)
+        size = tuple(self._size)
+        if size not in self._scenes and size in self.modes:
+            base = next(iter(self._scenes.values()))
+            # same top-down detail per camera px as the base size
+            self._scenes[size] = TrayScene(size, self.cfg, **{
+                **self._scene_kw, "calib": self.modes[size],
+                "px_mm": base.px_mm * size[0] / base.frame_size[0]})
+        if size in self._scenes and self._scenes[size] is not self.scene:
+            self.scene = self._scenes[size]
+            self._rendered = False
+        return True
+
+    def release(self):
+        self._opened = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render synthetic position camera frames")
+    parser.add_argument("--batteries", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shuffle", type=int, default=30, help="new poses every N frames, 0 = static")
+    parser.add_argument("--size", default="640x480", help="frame size the calib file is for")
+    parser.add_argument("--calib", default=None, help="calib file in camera/calib, default cam_pos.camera_calib")
+    parser.add_argument("--no-distort", action="store_true", help="undistorted frames (no K/D)")
+    parser.add_argument("--noise", type=float, default=2.0, help="gaussian noise std, gray levels")
+    parser.add_argument("--out", default="", help="save one frame here instead of showing them")
+    args = parser.parse_args()
+
+    size = tuple(map(int, args.size.split("x")))
+    cap = SyntheticCapture(args.batteries, size, seed=args.seed, shuffle_every=args.shuffle, fps=15,
+                           calib=args.calib, distort=not args.no_distort, noise=args.noise)
+    print(f"{len(cap.poses)} batteries placed")
+    if args.out:
+        ok, frame = cap.read()
+        cv2.imwrite(args.out, frame)
+        print("Saved:", args.out)
+    else:
+        print("▶  ESC to quit")
+        while cap.isOpened():
+            ok, frame = cap.read()
+            cv2.imshow("Synthetic tray", frame)
+            if cv2.waitKey(1) & 0xFF == 27:
+                break
+        cv2.destroyAllWindows()
@@ -0,0 +1,53 @@
+import os
+
+import cv2
+
+import engine.loader as ldr
+
+DEBUG = ldr.usr_cfg["main"]["debug"]
+
+
+def uses_torch(cfg=ldr.usr_cfg["cam_pos"]) -> bool:
+    """False when the detection model runs on onnxruntime, torch is then never imported"""
+    return not str(cfg["detect_model"]).endswith(".onnx") and cfg["backend"] != "onnx"
+
+
+def pin_cores(cores):
+    """Pin the calling thread (and the threads it starts later) to `cores`, [] = leave as is"""
+    if not cores:
+        return
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cores))
+    else:  # Windows: whole process only
+        import psutil
+        psutil.Process().cpu_affinity(list(cores))
+    if DEBUG: print("Pinned to cores", sorted(cores))
+
+
+def apply_thread_budget(role, process_wide=True, cfg=ldr.usr_cfg["threads"]):
+    """
+    Thread pools for one role of userConfig `threads` (gui, detect). 0 leaves the library
+    default. cv2.setNumThreads is per process: process_wide=False skips it (and the core
+    pinning on Windows), for the detection thread sharing the GUI process.
+    """
+    budget = cfg[role]
+    if process_wide and budget["cv2"] > 0:
+        cv2.setNumThreads(budget["cv2"])
+    if budget.get("torch", 0) > 0 or budget.get("interop", 0) > 0:
+        if uses_torch():
+            import torch
+            if budget["torch"] > 0:
+                torch.set_num_threads(budget["torch"])
+            if budget["interop"] > 0:
+                try:
+                    torch.set_num_interop_threads(budget["interop"])
+                except RuntimeError:  # only once per process, e.g. after a camera restart
+                    pass
+    if process_wide or hasattr(os, "sched_setaffinity"):
+        pin_cores(budget["cores"])
+    if DEBUG: print(f"Thread budget [{role}]: {dict(budget)}")
+
+
+def onnx_threads(cfg=ldr.usr_cfg["threads"]) -> int:
+    """intra_op_num_threads of the detection onnxruntime session, 0 = onnxruntime default"""
+    return cfg["detect"]["onnx"]
@@ -0,0 +1,117 @@
+import numpy as np
+
+import engine.loader as ldr
+from engine.geometry import DET_DTYPE
+from engine.pick import PickRanker, as_coords
+
+# One row per tracked battery, filtered tray mm / degrees
+TRACK_DTYPE = np.dtype(DET_DTYPE.descr + [("id", np.int32),
+                                          ("std_mm", np.float32),  # position std of the filter
+                                          ("hits", np.int32),
+                                          ("stable", np.bool_)])
+
+PROCESS_STD_MM = 0.1  # batteries don't move on their own, only a small drift per frame
+
+
+class BatteryTracker:
+    """
+    Keeps an identity per battery across frames (nearest centroid association in tray mm)
+    and filters its position with a constant-position Kalman filter. A track is stable once
+    its position std drops under track_conv_mm, which takes a few frames instead of the
+    frame_to_avg median.
+    """
+
+    def __init__(self, cfg=ldr.usr_cfg["main"]):
+        self.gate = cfg["track_gate_mm"]
+        self.r = cfg["track_meas_mm"] ** 2
+        self.q = PROCESS_STD_MM ** 2
+        self.conv = cfg["track_conv_mm"] ** 2
+        self.max_miss = cfg["track_max_miss"]
+        self.resend = max(cfg["frame_to_avg"], 1)  # frames before the same track is sent again
+        self.tracks = np.empty(0, TRACK_DTYPE)
+        self.var = np.empty(0)  # position variance per track (same on x and y)
+        self.misses = np.empty(0, int)
+        self._next_id = 0
+        self._sent_id = -1
+        self._since_sent = 0
+        self.ranker = PickRanker(cfg)
+        self.queue = np.empty(0, TRACK_DTYPE)  # stable tracks in the zone, next pick first
+
+    def _associate(self, det):
+        """Greedy nearest pairs under the gate -> (track idx, det idx)"""
+        if len(self.tracks) == 0 or len(det) == 0:
+            return np.empty(0, int), np.empty(0, int)
+        d = np.hypot(self.tracks["x_mm"][:, None] - det["x_mm"][None],
+                     self.tracks["y_mm"][:, None] - det["y_mm"][None])
+        ti, di = [], []
+        for flat in np.argsort(d, axis=None):
+            t, k = divmod(int(flat), len(det))
+            if d[t, k] > self.gate:
+                break
+            if t in ti or k in di:
+                continue
+            ti.append(t)
+            di.append(k)
+        return np.array(ti, int), np.array(di, int)
+
+    def update(self, det) -> np.ndarray:
+        """det: DET_DTYPE rows of the newest frame, returns all tracks"""
+        self.var += self.q  # predict, position unchanged
+        ti, di = self._associate(det)
+
+        # correct matched tracks
+        if len(ti):
+            k = self.var[ti] / (self.var[ti] + self.r)
+            tr, z = self.tracks[ti], det[di]
+            tr["x_mm"] += k * (z["x_mm"] - tr["x_mm"])
+            tr["y_mm"] += k * (z["y_mm"] - tr["y_mm"])
+            dt = (z["theta"] - tr["theta"] + 90) % 180 - 90  # [0, 180) wraps around
+            tr["theta"] = (tr["theta"] + k * dt) % 180
+            tr["cls"] = z["cls"]
+            tr["conf"] = z["conf"]
+            tr["hits"] += 1
+            self.tracks[ti] = tr
+            self.var[ti] *= 1 - k
+        missed = np.ones(len(self.tracks), bool)
+        missed[ti] = False
+        self.misses[ti] = 0
+        self.misses[missed] += 1
+
+        # drop lost tracks, start new ones for unmatched detections
+        keep = self.misses <= self.max_miss
+        self.tracks, self.var, self.misses = self.tracks[keep], self.var[keep], self.misses[keep]
+        new = np.ones(len(det), bool)
+        new[di] = False
+        n = int(new.sum())
+        if n:
+            born = np.zeros(n, TRACK_DTYPE)
+            for f in DET_DTYPE.names:
+                born[f] = det[new][f]
+            born["id"] = np.arange(self._next_id, self._next_id + n)
+            born["hits"] = 1
+            self._next_id += n
+            self.tracks = np.concatenate([self.tracks, born])
+            self.var = np.concatenate([self.var, np.full(n, self.r)])
+            self.misses = np.concatenate([self.misses, np.zeros(n, int)])
+
+        self.tracks["std_mm"] = np.sqrt(self.var)
+        self.tracks["stable"] = self.var <= self.conv  # a missed frame or two keeps it, so the pick does not flip
+        return self.tracks
+
+    def pick(self, ref=None):
+        """
+        Best stable track in the pick zone (PickRanker, arm 1 at ref) as np.array([x, y, theta, cls]),
+        or None. A track is sent when it converges, then again every frame_to_avg frames while it
+        stays the best (the arm may have been busy the first time). `queue` keeps the rest in order.
+        """
+        self._since_sent += 1
+        stable = self.tracks[self.tracks["stable"]]
+        self.queue = stable[self.ranker.rank(stable, ref)]
+        if len(self.queue) == 0:
+            return None
+        t = self.queue[0]
+        if t["id"] == self._sent_id and self._since_sent < self.resend:
+            return None
+        self._sent_id = int(t["id"])
+        self._since_sent = 0
+        return as_coords(t)
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+
+import engine.loader as ldr
+from engine.homography import same_h, tray_world_corners
+from engine.undistort import PointLens
+
+
+def tray_view_size(cfg=ldr.usr_cfg["cam_pos"]):
+    """(w, h) of the tray view image, fixed by the tray size and tray_view_px_mm"""
+    L, W = tray_world_corners(cfg)[2]
+    s = cfg["tray_view_px_mm"]
+    return int(round(L * s)), int(round(W * s))
+
+
+class TrayView:
+    """
+    One remap table from the raw (distorted) camera frame straight to a top-down image of
+    the tray at tray_view_px_mm pixels per mm: tray view px -> tray mm (scale) -> undistorted
+    px (H^-1) -> raw px (K, D). Replaces the full-frame undistort remap, the model then runs
+    on a smaller perspective-free image and tray view px -> mm is just `self.H` (a scale).
+    Rebuilt only when the tray homography moves (same_h), not for every re-solved H array.
+    """
+
+    def __init__(self, K, D, newK, cfg=ldr.usr_cfg["cam_pos"]):
+        self.lens = PointLens(K, D, newK)
+        self.size = tray_view_size(cfg)
+        s = cfg["tray_view_px_mm"]
+        # tray view px -> tray mm, what rects_to_mm / tray_roi get instead of the camera H
+        self.H = np.array([[1 / s, 0, 0], [0, 1 / s, 0], [0, 0, 1]], np.float64)
+        self.cfg = cfg
+        self.map1 = self.map2 = None
+        self._H_cam = None
+
+    def build(self, H_cam):
+        """H_cam: undistorted image px -> tray mm (HomographyCache.H)"""
+        w, h = self.size
+        u, v = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+        mm = np.stack([u, v, np.ones_like(u)], axis=-1).reshape(-1, 3) @ self.H.T
+        und = mm @ np.linalg.inv(H_cam).T  # undistorted px, homogeneous
+        raw = self.lens.distort(und[:, :2] / und[:, 2:3]).reshape(h, w, 2)
+        self.map1, self.map2 = cv2.convertMaps(raw, None, cv2.CV_16SC2)
+        self._H_cam = H_cam
+
+    def warp(self, raw, H_cam):
+        """Raw camera frame -> tray view, None while the tray homography is unknown"""
+        if H_cam is None:
+            return None
+        if self._H_cam is None or not same_h(H_cam, self._H_cam, self.cfg):
+            self.build(H_cam)
+        return cv2.remap(raw, self.map1, self.map2, cv2.INTER_LINEAR)
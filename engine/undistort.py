@@ -0,0 +1,30 @@
+import cv2
+import numpy as np
+
+
+class PointLens:
+    """
+    Lens model of the calib_*.npz (OpenCV pinhole + 5 distortion coefficients) for points
+    only: raw px <-> undistorted px (the newK image BatteryLocator remaps to). Lets the
+    pipeline run on the raw frame and correct just the few points it measures.
+    """
+
+    def __init__(self, K, D, newK):
+        self.K, self.D, self.newK = K, D, newK
+        self._newK_inv = np.linalg.inv(newK)
+
+    def undistort(self, pts) -> np.ndarray:
+        """(N, 2) raw px -> (N, 2) undistorted px"""
+        pts = np.asarray(pts, np.float32).reshape(-1, 1, 2)
+        if len(pts) == 0:
+            return pts.reshape(0, 2)
+        return cv2.undistortPoints(pts, self.K, self.D, P=self.newK).reshape(-1, 2)
+
+    def distort(self, pts) -> np.ndarray:
+        """(N, 2) undistorted px -> (N, 2) raw px"""
+        pts = np.asarray(pts, np.float64).reshape(-1, 2)
+        if len(pts) == 0:
+            return pts.astype(np.float32)
+        rays = np.concatenate([pts, np.ones((len(pts), 1))], axis=1) @ self._newK_inv.T
+        raw, _ = cv2.projectPoints(rays.reshape(-1, 1, 3), np.zeros(3), np.zeros(3), self.K, self.D)
+        return raw.reshape(-1, 2).astype(np.float32)
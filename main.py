@@ -56,7 +56,8 @@ class MainWindow(QMainWindow):
                 "connected": False,
                 "powered": False,
                 "enabled": False,
-                "state": None
+                "state": None,
+                "tcp": None  # [x, y, z, rx, ry, rz] in the tray user frame
                 })
         self.arm2_status = mp.Manager().dict({
                 "connected": False,
@@ -344,6 +345,9 @@ class MainWindow(QMainWindow):
 
         self.settings_window._update_ui()
         self._update_camera(self.reset_cam_flag.value)
+        tcp = self.arm1_status.get("tcp")
+        if tcp is not None:  # the pick ranking measures from arm 1
+            self.camPos.set_arm_pos(tcp[:2])
         arm_1_connected = self.arm1_status["connected"]
         arm_1_powered = self.arm1_status["powered"]
         arm_1_enabled = self.arm1_status["enabled"]
@@ -397,6 +401,12 @@ if __name__ == "__main__":
     from engine import task_kill
 
     task_kill.clean()
+    from engine.threads import apply_thread_budget
+    apply_thread_budget("gui")
+    if not ldr.usr_cfg["cam_pos"]["detect_process"]:  # the detection process loads its own
+        from engine.inference import preload
+        splash.text("Loading detection model...")
+        preload()  # background, CamPosition picks it up when it opens the camera
     app = QApplication(sys.argv)
     win = MainWindow()
     win.show()
@@ -3,6 +3,12 @@ import time
 import cv2
 import multiprocessing as mp
 from engine.detection import BatteryLocator
+from engine.pipeline import DetectionPipeline
+from engine.refine import PickRefiner
+from engine.geometry import DET_DTYPE
+from engine.tracker import TRACK_DTYPE
+from engine.threads import apply_thread_budget
+from worker.detect_proc import DetectionProcess, FrameRing, SharedDetections, pick_source
 
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QImage
@@ -14,57 +20,138 @@ DEBUG=ldr.usr_cfg["main"]["debug"]
 class CamPosition(QThread):
     change_pixmap_signal = pyqtSignal(QImage)  # live preview
     detection_signal = pyqtSignal(object)  # np.ndarray([x,y,z])
-    
+    tracks_signal = pyqtSignal(object)  # all tracked batteries, TRACK_DTYPE rows
+
     def __init__(self, is_Opened: mp.Event, parent=None):
         super().__init__(parent)
         self.isRun = True
         self.restart_thread = False
         self.bl = None
+        self.pipeline = None
+        self.proc = None
+        self.ring = None
+        self.shared = None
         self.is_Opened = is_Opened
-        self._buffer = []  # store raw xyz per frame
+        self.tracks = None  # newest tracks (or raw detections with the tracker off)
+        self.arm_pos = None  # arm 1 (x, y) in tray mm for the pick ranking, None: pick_ref_mm
+
+    def _emit_preview(self, bgr):
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        h, w, ch = rgb.shape
+        self.change_pixmap_signal.emit(
+            QImage(rgb.data, w, h, ch * w, QImage.Format_RGB888)
+        )
 
     # ------------------------------------------------------------------
-    def run(self, FRAMES_TO_AVG = ldr.usr_cfg["main"]["frame_to_avg"]):
+    def run(self):
+        if ldr.usr_cfg["cam_pos"]["detect_process"]:
+            self._run_process()
+        else:
+            self._run_thread()
+        self.clear_status()
+        if DEBUG: print("camPos released")
+        self.restart_thread = True
+
+    def _run_thread(self):
+        apply_thread_budget("detect", process_wide=False)  # cv2 pool is the GUI process one
         self.bl = BatteryLocator()
+        headless = ldr.usr_cfg["cam_pos"]["headless"]  # no preview at all
+        picker = pick_source(ldr.usr_cfg["main"])  # BatteryTracker, or the frame_to_avg median (current settings)
         if self.bl.stop:
             self.isRun = False
+        # prep / model / post on their own threads, update() hands back the finished frames
+        source = self.bl
+        if self.isRun and ldr.usr_cfg["cam_pos"]["pipeline"]:
+            self.pipeline = source = DetectionPipeline(self.bl).start()
+        # coarse-to-fine: the picked battery re-measured on a big frame
+        refiner = PickRefiner(self.bl) if self.isRun and ldr.usr_cfg["cam_pos"]["refine"] else None
         print("CamPos Run:", self.isRun)
         # ------------------------------------------------------------------
         while self.isRun and self.bl.cap.isOpened():
-            self.is_Opened.set() 
-            frame = self.bl.update()
+            self.is_Opened.set()
+            if self.pipeline is not None and self.pipeline.error is not None:  # a stage died, start over
+                self.pipeline.stop()
+                self.pipeline = source = DetectionPipeline(self.bl).start()
+            frame = source.update()
             if frame is not None:
-                # 1) Emit live preview
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = rgb.shape
-                self.change_pixmap_signal.emit(
-                    QImage(rgb.data, w, h, ch * w, QImage.Format_RGB888)
-                )
-
-                # 2) Collect battery coordinates
-                coord = self.bl.get_nearest_battery()
-                if coord is not None:
-                    self._buffer.append(coord)
-                # Once enough frames collected → compute median & emit
-                if len(self._buffer) >= FRAMES_TO_AVG:
-                    buf = np.array(self._buffer[int(FRAMES_TO_AVG * 0.5):])  # shape (N,4)
-                    arr = np.median(buf, axis=0)  # shape (4,)
-                    arr[3] = coord[3]  # OK now
+                # 1) Emit live preview, overlay only drawn at display rate
+                if not headless and self.bl.renderer.due():
+                    self._emit_preview(self.bl.render())
 
-                    if DEBUG:
-                        if DEBUG: print("Battery Coordinates:", arr)
+                # 2) Track batteries, send the nearest one once it is stable
+                if self.bl.fresh:  # reused detections are not new samples
+                    self.tracks = picker.update(self.bl.last_detections)
+                    self.tracks_signal.emit(self.tracks.copy())
+                    if refiner is not None:
+                        refiner.forget(self.tracks)  # refined target picked: a new battery there gets refined again
+                arr = picker.pick(self.arm_pos)
+                if arr is not None:
+                    if refiner is not None:
+                        arr = refiner.refine(arr)
+                    if DEBUG: print("Battery Coordinates:", arr)
                     self.detection_signal.emit(arr)
-                    self._buffer.clear()
             cv2.waitKey(1)
-        self.clear_status()
-        if DEBUG: print("camPos released")
-        self.restart_thread = True
+
+    def _run_process(self):
+        # capture + inference in DetectionProcess, this thread only forwards to Qt
+        self.ring = FrameRing()
+        self.shared = SharedDetections(TRACK_DTYPE if ldr.usr_cfg["main"]["tracker"] else DET_DTYPE)
+        self.proc = DetectionProcess(self.is_Opened, self.ring, self.shared)
+        self.proc.start()
+        print("CamPos Run: detection process", self.proc.pid)
+        # ------------------------------------------------------------------
+        while self.isRun and self.proc.is_alive():
+            if not self.shared.updated.wait(0.1):
+                continue
+            self.shared.updated.clear()
+            self.tracks = self.shared.read()
+            self.tracks_signal.emit(self.tracks)
+            frame = self.ring.read()
+            if frame is not None:
+                self._emit_preview(frame)
+            arr = self.shared.read_coord()
+            if arr is not None:
+                if DEBUG: print("Battery Coordinates:", arr)
+                self.detection_signal.emit(arr)
+
+    # ------------------------------------------------------------------
+    def set_arm_pos(self, xy):
+        """Arm 1 position (tray mm) the next pick is ranked from"""
+        self.arm_pos = (float(xy[0]), float(xy[1]))
+        if self.shared is not None:
+            self.shared.write_ref(self.arm_pos)
+
+    def stage_timings(self) -> dict:
+        """Per-stage stats of BatteryLocator (cam_pos.profile), {} when off or in process mode"""
+        if self.bl is None:
+            return {}
+        return self.bl.timer.summary()
+
+    def dump_timings(self, path):
+        """Per-stage stats + histograms to CSV, returns the path (None when nothing is recorded)"""
+        if self.bl is None:
+            return None
+        return self.bl.timer.to_csv(path)
 
     # ------------------------------------------------------------------
     def clear_status(self):
+        if self.proc is not None:
+            self.proc.stop()
+            self.proc.join(timeout=3)
+            if self.proc.is_alive():
+                self.proc.terminate()
+            self.ring.close()
+            self.proc = None
         self.is_Opened.clear()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.bl is None:
+            return
+        if getattr(self.bl, "grabber", None) is not None:
+            self.bl.grabber.stop()
         if self.bl.cap.isOpened():
             self.bl.cap.release()
 
     def stop(self):
-        self.isRun = False
\ No newline at end of file
+        self.isRun = False
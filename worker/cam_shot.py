@@ -4,6 +4,7 @@ from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QImage
 
 import engine.loader as ldr
+from engine.camera import open_camera
 
 DEBUG=ldr.usr_cfg["main"]["debug"]
 
@@ -24,7 +25,7 @@ class CamShot(QThread):
     def run(self):
         INDEX_CAM_2 = ldr.usr_cfg["cam_shot"]["idx"]
         if DEBUG: print(f"Cam Shot connecting to {INDEX_CAM_2}")
-        self.cap = cv2.VideoCapture(INDEX_CAM_2, cv2.CAP_DSHOW)
+        self.cap = open_camera(ldr.usr_cfg["cam_shot"])
         if not self.cap.isOpened():
             # raise RuntimeError("Cannot open camera", cfg["idx"])
             print("Cannot open camera " + str(INDEX_CAM_2))
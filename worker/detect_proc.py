@@ -0,0 +1,250 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import numpy.lib.recfunctions as rfn
+
+import engine.loader as ldr
+from engine.geometry import DET_DTYPE, empty_detections
+from engine.pick import PickRanker, as_coords
+from engine.tracker import BatteryTracker
+
+DEBUG=ldr.usr_cfg["main"]["debug"]
+
+MAX_DET = 64  # batteries (or tracks) per frame kept in SharedDetections
+
+
+class CoordAverager:
+    """Median of the best battery in the pick zone over frame_to_avg frames, first half dropped (settling)"""
+
+    def __init__(self, frames_to_avg=ldr.usr_cfg["main"]["frame_to_avg"], cfg=ldr.usr_cfg["main"]):
+        self.frames_to_avg = frames_to_avg
+        self._buffer = []  # store raw xyz per frame
+        self.tracks = empty_detections()
+        self.ranker = PickRanker(cfg)
+        self.queue = empty_detections()  # detections in the zone, best first
+
+    def update(self, det) -> np.ndarray:
+        """Same interface as BatteryTracker, the 'tracks' are the raw detections"""
+        self.tracks = det
+        return det
+
+    def pick(self, ref=None):
+        """Averaged (4,) array once frame_to_avg frames with a battery were collected, else None"""
+        self.queue = self.tracks[self.ranker.rank(self.tracks, ref)]
+        if len(self.queue):
+            self._buffer.append(tuple(int(val) for val in as_coords(self.queue[0])))
+        # Once enough frames collected → compute median
+        if len(self._buffer) < self.frames_to_avg:
+            return None
+        buf = np.array(self._buffer[int(self.frames_to_avg * 0.5):])  # shape (N,4)
+        arr = np.median(buf, axis=0)  # shape (4,)
+        arr[3] = self._buffer[-1][3]  # class of the last frame, not a median
+        self._buffer.clear()
+        return arr
+
+
+def pick_source(cfg=ldr.usr_cfg["main"]):
+    """What turns per-frame detections into coordinates for arm 1"""
+    if cfg["tracker"]:
+        return BatteryTracker(cfg)
+    return CoordAverager(cfg["frame_to_avg"], cfg)
+
+
+# ------------------------------------------------------------------
+#  Shared memory transport
+# ------------------------------------------------------------------
+class FrameRing:
+    """
+    Preview frames from the detection process to the GUI through a shared_memory ring of
+    preallocated slots. The producer creates the block once the camera size is known;
+    `latest` is only bumped after a slot is fully written, the consumer copies the newest slot.
+    """
+
+    def __init__(self, slots=3):
+        self.slots = slots
+        self.shape = mp.Array('i', 3, lock=False)  # h, w, ch
+        self.name = mp.Array('c', 64, lock=False)
+        self.latest = mp.Value('q', 0, lock=False)  # seq of the newest complete slot
+        self.ready = mp.Event()
+        self._shm = None
+        self._views = None
+        self._taken = 0
+
+    def _map(self):
+        shape = tuple(self.shape)
+        buf = np.ndarray((self.slots, *shape), np.uint8, buffer=self._shm.buf)
+        self._views = [buf[i] for i in range(self.slots)]
+
+    # ---- producer (detection process) ----
+    def create(self, shape):
+        self.shape[:] = shape
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * int(np.prod(shape)))
+        self.name.value = self._shm.name.encode()
+        self._map()
+        self.ready.set()
+
+    def write(self, frame):
+        seq = self.latest.value + 1
+        np.copyto(self._views[seq % self.slots], frame)
+        self.latest.value = seq
+
+    # ---- consumer (GUI) ----
+    def read(self):
+        """Copy of the newest frame not read yet, or None"""
+        if self._shm is None:
+            if not self.ready.is_set():
+                return None
+            self._shm = shared_memory.SharedMemory(name=self.name.value.decode())
+            self._map()
+        seq = self.latest.value
+        if seq == self._taken:
+            return None
+        frame = self._views[seq % self.slots].copy()
+        if self.latest.value - seq >= self.slots - 1:  # producer lapped us during the copy
+            return None
+        self._taken = seq
+        return frame
+
+    def close(self, unlink=False):
+        if self._shm is None:
+            return
+        self._views = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+            self.ready.clear()
+        self._shm = None
+
+
+class SharedDetections:
+    """Detections (or tracks) of the newest frame + the last pick coordinate, shared struct"""
+
+    def __init__(self, dtype=DET_DTYPE):
+        self.dtype = dtype
+        self.width = len(dtype.names)
+        self.lock = mp.Lock()
+        self.updated = mp.Event()  # set by the producer on every frame
+        self.seq = mp.Value('q', 0, lock=False)
+        self.count = mp.Value('i', 0, lock=False)
+        self.fps = mp.Value('d', 0.0, lock=False)
+        self.data = mp.Array('d', MAX_DET * self.width, lock=False)  # one row per dtype field
+        self.coord = mp.Array('d', 4, lock=False)
+        self.coord_seq = mp.Value('q', 0, lock=False)
+        self.ref = mp.Array('d', [np.nan, np.nan], lock=False)  # arm 1 x, y from the GUI, nan: unknown
+        self._coord_taken = 0
+
+    def write(self, det, fps=0.0):
+        n = min(len(det), MAX_DET)
+        flat = rfn.structured_to_unstructured(det[:n], np.float64).ravel()
+        with self.lock:
+            self.data[:n * self.width] = flat.tolist()
+            self.count.value = n
+            self.fps.value = fps
+            self.seq.value += 1
+        self.updated.set()
+
+    def publish_coord(self, arr):
+        with self.lock:
+            self.coord[:] = [float(v) for v in arr]
+            self.coord_seq.value += 1
+        self.updated.set()
+
+    def read(self):
+        with self.lock:
+            n = self.count.value
+            flat = np.array(self.data[:n * self.width]).reshape(n, self.width)
+        return rfn.unstructured_to_structured(flat, self.dtype)
+
+    def write_ref(self, xy):
+        with self.lock:
+            self.ref[:] = [float(v) for v in xy]
+
+    def read_ref(self):
+        """Arm 1 (x, y) for the pick ranking, None until the GUI wrote one"""
+        with self.lock:
+            ref = tuple(self.ref[:])
+        return None if np.isnan(ref[0]) else ref
+
+    def read_coord(self):
+        """New pick coordinate since the last call, or None"""
+        with self.lock:
+            if self.coord_seq.value == self._coord_taken:
+                return None
+            self._coord_taken = self.coord_seq.value
+            return np.array(self.coord[:])
+
+
+# ------------------------------------------------------------------
+#  Detection process
+# ------------------------------------------------------------------
+class DetectionProcess(mp.Process):
+    """
+    Position camera capture + BatteryLocator in their own process, so inference does not share
+    the GIL with Qt painting and CamShot. Preview frames go out through a FrameRing,
+    detections through SharedDetections.
+    """
+
+    def __init__(self, is_Opened: mp.Event, ring: FrameRing, shared: SharedDetections):
+        super().__init__(daemon=True)
+        self.is_Opened = is_Opened
+        self.ring = ring
+        self.shared = shared
+        self.stop_event = mp.Event()
+
+    def run(self):
+        from engine.threads import apply_thread_budget
+        apply_thread_budget("detect")  # before torch / the model spin up their pools
+        from engine.detection import BatteryLocator
+
+        bl = BatteryLocator()
+        if bl.stop:
+            print("CamPos process: camera not opened")
+            return
+        headless = ldr.usr_cfg["cam_pos"]["headless"]
+        picker = pick_source(ldr.usr_cfg["main"])
+        source = bl
+        if ldr.usr_cfg["cam_pos"]["pipeline"]:
+            from engine.pipeline import DetectionPipeline
+            source = DetectionPipeline(bl).start()
+        refiner = None
+        if ldr.usr_cfg["cam_pos"]["refine"]:
+            from engine.refine import PickRefiner
+            refiner = PickRefiner(bl)
+        self.ring.create((bl.h_img, bl.w_img, 3))
+        self.is_Opened.set()
+        if DEBUG: print("CamPos process started")
+        try:
+            while not self.stop_event.is_set() and bl.cap.isOpened():
+                if source is not bl and source.error is not None:  # a stage died, start over
+                    source.stop()
+                    source = DetectionPipeline(bl).start()
+                frame = source.update()
+                if frame is None:
+                    continue
+                if not headless and bl.renderer.due():
+                    self.ring.write(bl.render())
+                tracks = picker.update(bl.last_detections) if bl.fresh else picker.tracks
+                self.shared.write(tracks, bl.fps)
+                if refiner is not None and bl.fresh:
+                    refiner.forget(tracks)  # refined target picked: a new battery there gets refined again
+
+                arr = picker.pick(self.shared.read_ref())
+                if arr is not None:
+                    if refiner is not None:
+                        arr = refiner.refine(arr)
+                    if DEBUG: print("Battery Coordinates:", arr)
+                    self.shared.publish_coord(arr)
+        finally:
+            self.is_Opened.clear()
+            if source is not bl:
+                source.stop()
+            if bl.timer.enabled:  # the GUI can't pull them from here, leave them on disk
+                path = bl.timer.to_csv(ldr.PROJECT_ROOT / "profiles" / "timing_cam_pos.csv")
+                print("CamPos stage timings saved to:", path)
+            bl.release()
+            self.ring.close(unlink=True)
+            if DEBUG: print("CamPos process released")
+
+    def stop(self):
+        self.stop_event.set()